@@ -1,10 +1,18 @@
 # utils/db.py
 import os
+import time
 import hashlib
+import threading
 import mysql.connector
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
 from mysql.connector import Error
+from mysql.connector.errorcode import ER_UNKNOWN_STMT_HANDLER
 from mysql.connector import pooling
 from contextlib import contextmanager
+from itertools import chain
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from flask import current_app, has_app_context
@@ -19,7 +27,17 @@ DB_PORT = int(os.getenv("DB_PORT", "3306"))
 DB_USER = os.getenv("DB_USER", "root")
 DB_PASS = os.getenv("DB_PASS", "")
 DB_NAME = os.getenv("DB_NAME", "dbcocoa")
-DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# pool เต็ม → รอคืน connection ได้นานสุดกี่ ms ก่อนยอมแพ้
+DB_POOL_WAIT_MS = int(os.getenv("DB_POOL_WAIT_MS", "2000"))
+# ใช้ C extension เป็นค่าเริ่มต้น (parse/serialize แถวใน C); ตั้ง DB_USE_PURE=1 เพื่อบังคับ pure-Python
+# ติดตั้งแบบไม่มี C extension → ถอยไป pure เองแทนที่ connect จะ raise ImportError
+_HAVE_CEXT = getattr(mysql.connector, "HAVE_CEXT", False)
+DB_USE_PURE = os.getenv("DB_USE_PURE", "0").strip().lower() in ("1", "true", "yes") or not _HAVE_CEXT
+# READ COMMITTED: INSERT/UPDATE ลง mark_zone ไม่ต้องล็อก gap แบบ REPEATABLE READ → โซนเดียวกันเขียนพร้อมกันได้ลื่นกว่า
+# ตั้งระดับ session ครั้งเดียวตอนเปิด connection (init_command) ไม่ต้องส่ง SET ทุก transaction
+DB_ISOLATION = os.getenv("DB_ISOLATION", "READ COMMITTED").strip().upper()
+_INIT_COMMAND = f"SET SESSION TRANSACTION ISOLATION LEVEL {DB_ISOLATION}" if DB_ISOLATION else None
 
 # ====== LOGGER ======
 def _log(level: str, msg: str):
@@ -30,11 +48,18 @@ def _log(level: str, msg: str):
 
 # ====== CONNECTION POOL ======
 _pool: pooling.MySQLConnectionPool | None = None
+_pool_lock = threading.Lock()
 
 def _init_pool():
-    global _pool
     if _pool is not None:
         return
+    with _pool_lock:
+        # หลาย thread เข้ามาพร้อมกันตอน boot → สร้าง pool แค่ครั้งเดียว
+        if _pool is None:
+            _create_pool()
+
+def _create_pool():
+    global _pool
     cfg = dict(
         host=DB_HOST,
         port=DB_PORT,
@@ -42,14 +67,22 @@ def _init_pool():
         password=DB_PASS,
         database=DB_NAME,
         autocommit=False,    # ให้โค้ดฝั่ง route เป็นคน commit/rollback
-        use_pure=True,
+        use_pure=DB_USE_PURE,
+        charset="utf8mb4",   # ตั้งครั้งเดียวตอน handshake ไม่ต้อง SET NAMES ทุก checkout
+        collation="utf8mb4_unicode_ci",
     )
+    if _INIT_COMMAND:
+        cfg["init_command"] = _INIT_COMMAND
     _pool = pooling.MySQLConnectionPool(
         pool_name="dbcocoa_pool",
         pool_size=DB_POOL_SIZE,
+        pool_reset_session=False,  # ไม่ต้องส่ง COM_RESET_CONNECTION ทุกครั้งที่คืน connection
         **cfg
     )
-    _log("info", f"MySQL pool created: host={DB_HOST}:{DB_PORT}, db={DB_NAME}, size={DB_POOL_SIZE}")
+    _log("info", f"MySQL pool created: host={DB_HOST}:{DB_PORT}, db={DB_NAME}, size={DB_POOL_SIZE}, "
+                 f"driver={'pure' if DB_USE_PURE else 'cext'}")
+    if not _HAVE_CEXT:
+        _log("warning", "mysql-connector C extension not available; using pure-Python protocol")
 
 def _ensure_utf8mb4(conn: mysql.connector.MySQLConnection):
     # บางเวอร์ชันมี set_charset_collation, บางเวอร์ชันต้อง SET NAMES
@@ -65,33 +98,59 @@ def _ensure_utf8mb4(conn: mysql.connector.MySQLConnection):
         except Exception as e:
             _log("warning", f"Cannot enforce utf8mb4 on connection: {e}")
 
+def _checkout():
+    """ยืม connection จาก pool; ถ้า pool เต็มชั่วคราวให้ถอยรอแทนการเปิด TCP ใหม่"""
+    deadline = time.monotonic() + DB_POOL_WAIT_MS / 1000.0
+    delay = 0.005
+    while True:
+        try:
+            return _pool.get_connection()
+        except pooling.PoolError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
 def get_db_connection() -> mysql.connector.MySQLConnection | None:
     """คืน MySQL connection 1 ตัวจาก pool (หรือสร้างเดี่ยวถ้า pool ใช้ไม่ได้)"""
     try:
         _init_pool()
-        conn = _pool.get_connection() if _pool else mysql.connector.connect(
-            host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, database=DB_NAME, autocommit=False, use_pure=True
+        if _pool:
+            conn = _checkout()
+            # pool ไม่ reset session แล้ว → ปิด transaction ที่ผู้ใช้ก่อนหน้าค้างไว้ (เช่น SELECT ที่ไม่ได้ commit)
+            if conn.in_transaction:
+                conn.rollback()
+            return conn
+        # fallback: connection เดี่ยว ไม่ได้ผ่าน cfg ของ pool จึงต้องบังคับ utf8mb4 เอง
+        conn = mysql.connector.connect(
+            host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, database=DB_NAME, autocommit=False, use_pure=DB_USE_PURE
         )
         _ensure_utf8mb4(conn)
+        if _INIT_COMMAND:
+            cur = conn.cursor()
+            cur.execute(_INIT_COMMAND)
+            cur.close()
         return conn
     except Error as e:
         _log("error", f"เกิดข้อผิดพลาดในการเชื่อมต่อ MySQL: {getattr(e,'msg',str(e))}")
         return None
 
 @contextmanager
-def db_cursor(dict: bool = True, commit: bool = True):
+def db_cursor(dict: bool = True, commit: bool = True, prepared: bool = False):
     """
     ใช้แบบ:
     with db_cursor(dict=True) as (cur, conn):
         cur.execute("SELECT ...")
         rows = cur.fetchall()
+
+    prepared=True ใช้ server-side prepared statement (เหมาะกับ SQL คงที่ที่เรียกบ่อย)
     """
     conn = get_db_connection()
     if conn is None:
         # ทำให้ผู้เรียกตรวจจับได้
         raise RuntimeError("Cannot get MySQL connection")
 
-    cur = conn.cursor(dictionary=dict)
+    cur = conn.cursor(dictionary=dict, prepared=True) if prepared else conn.cursor(dictionary=dict)
     try:
         yield cur, conn
         if commit:
@@ -112,12 +171,108 @@ def db_cursor(dict: bool = True, commit: bool = True):
         except Exception:
             pass
 
-# ====== HELPERS ======
+def prepared_cursor(conn, sql: str):
+    """prepared cursor ที่ผูกกับ connection จริงใน pool (ไม่ใช่ wrapper ที่เปลี่ยนทุก checkout)
+    pool ไม่ reset session → statement ที่ prepare แล้วยังอยู่ฝั่ง server รอบถัดไปส่งแค่ค่าพารามิเตอร์
+    ผู้เรียกต้อง fetchall() ให้หมดทุกครั้ง (cursor นี้ unbuffered และไม่ถูกปิดตอนคืน connection)"""
+    raw = getattr(conn, "_cnx", None) or conn
+    stmts = raw.__dict__.setdefault("_prepared_stmts", {})
+    cur = stmts.get(sql)
+    if cur is None:
+        cur = stmts[sql] = raw.cursor(prepared=True)
+    return cur
+
+def run_prepared(conn, sql: str, params: tuple, dict: bool = False) -> list:
+    """execute + fetchall ผ่าน prepared_cursor; statement หายฝั่ง server (เช่น pool reconnect) → prepare ใหม่หนึ่งรอบ
+    dict=True คืนแต่ละแถวเป็น dict ตามชื่อคอลัมน์ (prepared cursor ของ connector ไม่มีโหมด dictionary)"""
+    cur = prepared_cursor(conn, sql)
+    try:
+        cur.execute(sql, params)
+    except Error as e:
+        # retry เฉพาะกรณี handle ของ statement หาย; error อื่น (lock wait, สิทธิ์, syntax) ส่งต่อเลย ไม่รันซ้ำ
+        # connection หลุดกลางทางก็ไม่ retry: transaction เดิมหายไปแล้ว รันต่อบน session ใหม่จะ commit ครึ่ง ๆ
+        if e.errno != ER_UNKNOWN_STMT_HANDLER:
+            raise
+        raw = getattr(conn, "_cnx", None) or conn
+        raw.__dict__.get("_prepared_stmts", {}).pop(sql, None)
+        try:
+            cur.close()
+        except Exception:
+            pass
+        cur = prepared_cursor(conn, sql)
+        cur.execute(sql, params)
+    rows = cur.fetchall()
+    if dict:
+        cols = cur.column_names
+        return [{c: v for c, v in zip(cols, r)} for r in rows]
+    return rows
+
+# 500 แถว x 4 คอลัมน์ต่อ statement: ห่างจาก max_allowed_packet ค่าเริ่มต้นมาก แม้ polygon/marks ชุดใหญ่
+BULK_INSERT_CHUNK = int(os.getenv("BULK_INSERT_CHUNK", "500"))
+
+@lru_cache(maxsize=64)
+def _bulk_insert_sql(table: str, cols: tuple, nrows: int) -> str:
+    # SQL ต่อ (ตาราง, คอลัมน์, จำนวนแถว) สร้างครั้งเดียวทั้ง process; chunk เต็มจะ hit เสมอ
+    row_sql = "(" + ", ".join(["%s"] * len(cols)) + ")"
+    return f"INSERT INTO {table} ({', '.join(cols)}) VALUES " + ", ".join([row_sql] * nrows)
+
+def bulk_insert(cursor, table: str, cols, rows, chunk: int = BULK_INSERT_CHUNK) -> int:
+    """INSERT หลายแถวเป็น VALUES (...),(...) ทีละ chunk แทน executemany; คืนจำนวนแถวที่ส่งไป
+    (table/cols ต้องเป็นค่าคงที่ในโค้ด ห้ามมาจาก input ผู้ใช้)"""
+    rows = list(rows)
+    if not rows:
+        return 0
+    cols = tuple(cols)
+    for start in range(0, len(rows), chunk):
+        part = rows[start:start + chunk]
+        cursor.execute(_bulk_insert_sql(table, cols, len(part)), tuple(chain.from_iterable(part)))
+    return len(rows)
+
+# ====== PASSWORD HASHING ======
+# Argon2id ค่าเริ่มต้นตาม OWASP (m=46 MiB, t=2, p=1); ปรับตามเครื่องได้ผ่าน env
+# เปลี่ยนค่าแล้ว hash เดิมจะถูก rehash อัตโนมัติตอน login ครั้งถัดไป (password_needs_rehash)
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_KIB = int(os.getenv("ARGON2_MEMORY_KIB", str(46 * 1024)))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+_ph = PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_KIB, parallelism=ARGON2_PARALLELISM)
+
+# argon2-cffi ปล่อย GIL ระหว่างคำนวณ → ใช้ thread pool ได้ (ไม่ต้อง process pool)
+# จำกัดจำนวนที่รันพร้อมกัน = จำนวน core: ไม่แย่ง CPU กันเอง และ RAM ไม่พุ่ง (46 MiB ต่อการ hash)
+PW_HASH_WORKERS = int(os.getenv("PW_HASH_WORKERS", str(os.cpu_count() or 2)))
+_hash_pool = ThreadPoolExecutor(max_workers=PW_HASH_WORKERS, thread_name_prefix="pwhash")
+
+def _verify_argon2(hashed: str, password: str) -> bool:
+    try:
+        return _ph.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
 def hash_password(password: str) -> str:
-    """เข้ารหัสรหัสผ่านด้วย SHA-256 (แนะนำให้ไปใช้ bcrypt/argon2 สำหรับ production)"""
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+    """เข้ารหัสรหัสผ่านด้วย Argon2id"""
+    return _hash_pool.submit(_ph.hash, password).result()
+
+def verify_password(hashed: str, password: str) -> bool:
+    """ตรวจรหัสผ่านกับ hash แบบ Argon2 (คืน False แทนการ raise)"""
+    return _hash_pool.submit(_verify_argon2, hashed, password).result()
+
+def password_needs_rehash(hashed: str) -> bool:
+    """True ถ้า hash ไม่ใช่ Argon2 หรือใช้พารามิเตอร์เก่ากว่าค่าปัจจุบัน"""
+    if not hashed or not hashed.startswith("$argon2"):
+        return True
+    try:
+        return _ph.check_needs_rehash(hashed)
+    except Exception:
+        return True
+
+def legacy_sha256(password: str, _sha256=hashlib.sha256) -> str:
+    """SHA-256 hex แบบเดิม ใช้ตรวจ/ย้ายรหัสผ่านเก่าเท่านั้น (ลบได้เมื่อย้ายเป็น argon2 ครบ)"""
+    return _sha256(password.encode("utf-8")).hexdigest()
+
+# ====== HELPERS ======
+
+_ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif'})
 
 def allowed_file(filename: str) -> bool:
     """ตรวจสอบนามสกุลไฟล์ที่อนุญาต"""
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in _ALLOWED_EXTENSIONS
@@ -0,0 +1,115 @@
+# config/tokens.py
+# JWT (HS256) ที่ใช้ร่วมกันทุก blueprint: encode ด้วย HMAC ที่ key ไว้แล้ว + decode ผ่าน cache
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import jwt
+from cachetools import TLRUCache
+
+# ====== ENCODE ======
+def _b64url(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
+
+# header ของ HS256 คงที่ → encode ครั้งเดียวตอน import (รูปแบบเดียวกับ PyJWT)
+_JWT_HEADER_B64 = _b64url(json.dumps({"alg": "HS256", "typ": "JWT"}, separators=(",", ":"), sort_keys=True).encode())
+_JWT_HEADER_STR = _JWT_HEADER_B64.decode("ascii")
+
+@lru_cache(maxsize=4)
+def _get_hmac(secret: str):
+    # key schedule ของ HMAC-SHA256 คำนวณครั้งเดียวต่อ secret; แต่ละ token ใช้ .copy()
+    return hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+def encode_hs256(payload: dict, secret: str) -> str:
+    """เทียบเท่า jwt.encode(payload, secret, algorithm='HS256') แต่ไม่ re-key HMAC ทุกครั้ง"""
+    claims = dict(payload)
+    for k in ('exp', 'iat', 'nbf'):
+        if isinstance(claims.get(k), datetime):
+            claims[k] = calendar.timegm(claims[k].utctimetuple())
+    signing_input = _JWT_HEADER_B64 + b"." + _b64url(json.dumps(claims, separators=(",", ":")).encode())
+    h = _get_hmac(secret).copy()
+    h.update(signing_input)
+    return (signing_input + b"." + _b64url(h.digest())).decode("ascii")
+
+# ====== DECODE ======
+# decoder ตัวเดียวทั้ง module + key ที่ encode เป็น bytes แล้ว (ไม่ต้อง force_bytes ทุก request)
+_JWT = jwt.PyJWT()
+_JWT_ALGS = ['HS256']
+
+@lru_cache(maxsize=4)
+def _key_bytes(secret: str) -> bytes:
+    return secret.encode("utf-8")
+
+# อายุ cache ต่อ token = min(TOKEN_CACHE_TTL, เวลาที่เหลือถึง exp) → token หมดอายุไม่มีทางเสิร์ฟจาก cache
+TOKEN_CACHE_TTL = 30
+
+def _ttu(key, payload, now):
+    exp = payload.get('exp')
+    return now + TOKEN_CACHE_TTL if exp is None else min(now + TOKEN_CACHE_TTL, exp)
+
+# key = (sha256(token), secret): ไม่เก็บ token ดิบไว้ใน memory; เปลี่ยน secret แล้ว token เดิมไม่ hit
+_DECODE_CACHE = TLRUCache(maxsize=10_000, ttu=_ttu, timer=time.time)
+_DECODE_LOCK = threading.Lock()
+_inflight: dict = {}  # key -> threading.Event ของ thread ที่กำลัง decode token นี้อยู่
+
+def _precheck_token(token: str) -> None:
+    """คัด token ที่รูปแบบผิดทิ้งก่อนเสีย HMAC: ต้องมี 3 ส่วน และ header เป็น HS256"""
+    header, sep, rest = token.partition('.')
+    if not sep or rest.count('.') != 1:
+        raise jwt.DecodeError('Not enough segments')
+    if header == _JWT_HEADER_STR:  # token ที่เราออกเองมี header แบบนี้เสมอ
+        return
+    try:
+        alg = json.loads(base64.urlsafe_b64decode(header + '=' * (-len(header) % 4))).get('alg')
+    except Exception:
+        raise jwt.DecodeError('Invalid header')
+    if alg != 'HS256':
+        raise jwt.InvalidAlgorithmError('The specified alg value is not allowed')
+
+def decode_token(token: str, secret: str) -> dict:
+    """jwt.decode แบบมี cache + single-flight (token เดียวกันที่เข้ามาพร้อมกันตรวจ HMAC ครั้งเดียว)
+    raise jwt.InvalidTokenError (รวม ExpiredSignatureError) เหมือน jwt.decode; ผลที่ไม่ผ่านไม่ถูก cache"""
+    key = (hashlib.sha256(token.encode()).digest(), secret)
+    with _DECODE_LOCK:
+        payload = _DECODE_CACHE.get(key)
+    if payload is not None:
+        return payload
+    _precheck_token(token)  # miss → คัดขยะทิ้งก่อนจอง single-flight / HMAC
+
+    while True:
+        with _DECODE_LOCK:
+            payload = _DECODE_CACHE.get(key)
+            if payload is not None:
+                return payload
+            ev = _inflight.get(key)
+            if ev is None:
+                ev = _inflight[key] = threading.Event()
+                break
+        # มี thread อื่น decode อยู่ → รอแล้ววนกลับไปอ่าน cache
+        # (ถ้า token เสีย ตัวนำจะไม่ใส่ cache → รอบถัดไปเราจะเป็นตัวนำ decode เองแล้ว raise)
+        ev.wait()
+
+    try:
+        payload = _JWT.decode(token, _key_bytes(secret), algorithms=_JWT_ALGS)
+        with _DECODE_LOCK:
+            _DECODE_CACHE[key] = payload
+        return payload
+    finally:
+        with _DECODE_LOCK:
+            _inflight.pop(key, None)
+        ev.set()
+
+def bearer_payload(auth_header: str | None, secret: str) -> dict | None:
+    """'Bearer <token>' → payload หรือ None ถ้าไม่มี/ไม่ผ่าน"""
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    try:
+        return decode_token(auth_header[7:], secret)
+    except jwt.InvalidTokenError:
+        return None
@@ -112,15 +112,16 @@ CREATE TABLE `users` (
   `username` varchar(50) DEFAULT NULL,
   `user_tel` varchar(50) DEFAULT NULL,
   `user_password` varchar(255) DEFAULT NULL,
-  `name` varchar(50) DEFAULT NULL
+  `name` varchar(50) DEFAULT NULL,
+  `last_login_at` datetime DEFAULT NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
 
 --
 -- Dumping data for table `users`
 --
 
-INSERT INTO `users` (`user_id`, `username`, `user_tel`, `user_password`, `name`) VALUES
-(1, 'kkk', '3202155555', '8d969eef6ecad3c29a3a629280e686cf0c3f5d5a86aff3ca12020c923adc6c92', 'kkkl');
+INSERT INTO `users` (`user_id`, `username`, `user_tel`, `user_password`, `name`, `last_login_at`) VALUES
+(1, 'kkk', '3202155555', '8d969eef6ecad3c29a3a629280e686cf0c3f5d5a86aff3ca12020c923adc6c92', 'kkkl', NULL);
 
 -- --------------------------------------------------------
 
@@ -152,14 +153,14 @@ INSERT INTO `zone` (`zone_id`, `zone_name`, `num_trees`, `field_id`, `created_at
 --
 ALTER TABLE `field`
   ADD PRIMARY KEY (`field_id`),
-  ADD KEY `user_id` (`user_id`);
+  ADD KEY `ix_field_user_name` (`user_id`,`field_name`);
 
 --
 -- Indexes for table `field_point`
 --
 ALTER TABLE `field_point`
   ADD PRIMARY KEY (`point_id`),
-  ADD KEY `field_id` (`field_id`);
+  ADD KEY `ix_field_point_cover` (`field_id`,`point_order`,`latitude`,`longitude`);
 
 --
 -- Indexes for table `history`
@@ -173,20 +174,22 @@ ALTER TABLE `history`
 --
 ALTER TABLE `mark_zone`
   ADD PRIMARY KEY (`mark_id`),
-  ADD KEY `zone_id` (`zone_id`);
+  ADD KEY `ix_mark_zone_order` (`zone_id`,`tree_no`,`mark_id`,`latitude`,`longitude`);
 
 --
 -- Indexes for table `users`
 --
 ALTER TABLE `users`
-  ADD PRIMARY KEY (`user_id`);
+  ADD PRIMARY KEY (`user_id`),
+  ADD UNIQUE KEY `uk_username` (`username`),
+  ADD UNIQUE KEY `uk_user_tel` (`user_tel`);
 
 --
 -- Indexes for table `zone`
 --
 ALTER TABLE `zone`
   ADD PRIMARY KEY (`zone_id`),
-  ADD KEY `field_id` (`field_id`);
+  ADD KEY `ix_zone_field_name` (`field_id`,`zone_name`);
 
 --
 -- AUTO_INCREMENT for dumped tables
@@ -0,0 +1,20 @@
+-- migrations/001_users_login.sql
+-- ปรับ DB ที่มีอยู่แล้วให้ตรงกับ dbcocoa.sql ฝั่ง users (login / register)
+-- รันซ้ำได้ (idempotent) บน MariaDB 10.4+:
+--   mysql -u root dbcocoa < migrations/001_users_login.sql
+--
+-- ถ้ามี username/user_tel ซ้ำอยู่ก่อน ADD UNIQUE KEY จะล้ม → ตรวจก่อนด้วย
+--   SELECT username, COUNT(*) FROM users GROUP BY username HAVING COUNT(*) > 1;
+--   SELECT user_tel, COUNT(*) FROM users GROUP BY user_tel HAVING COUNT(*) > 1;
+
+-- authenticate_user stamp เวลานี้หลังรหัสผ่านถูกต้องเท่านั้น
+ALTER TABLE `users`
+  ADD COLUMN IF NOT EXISTS `last_login_at` datetime DEFAULT NULL;
+
+-- register_user แยก "ซ้ำ" จาก ER_DUP_ENTRY ของ key เหล่านี้ (ไม่มี key = สมัครซ้ำได้เงียบ ๆ)
+ALTER TABLE `users`
+  ADD UNIQUE KEY IF NOT EXISTS `uk_username` (`username`),
+  ADD UNIQUE KEY IF NOT EXISTS `uk_user_tel` (`user_tel`);
+
+-- เดิม login ผ่าน procedure นี้; ตอนนี้ใช้ SELECT ตรง → ลบทิ้งถ้ายังค้างอยู่
+DROP PROCEDURE IF EXISTS `sp_authenticate`;
@@ -0,0 +1,28 @@
+-- migrations/002_covering_indexes.sql
+-- เปลี่ยน index ของ DB ที่มีอยู่แล้วให้ตรงกับ dbcocoa.sql (index ครอบคลุม query ที่ route ใช้บ่อย)
+-- รันซ้ำได้ (idempotent) บน MariaDB 10.4+:
+--   mysql -u root dbcocoa < migrations/002_covering_indexes.sql
+--
+-- เพิ่ม index ใหม่ก่อนแล้วค่อยลบตัวเก่าใน ALTER เดียวกัน: FK ยังมี index ที่ขึ้นต้นด้วยคอลัมน์ของมันตลอด
+
+-- get_fields: WHERE user_id ORDER BY field_name
+ALTER TABLE `field`
+  ADD KEY IF NOT EXISTS `ix_field_user_name` (`user_id`,`field_name`),
+  DROP KEY IF EXISTS `user_id`;
+
+-- get_field_details: WHERE field_id ORDER BY point_order (point_id = PK ติดมาใน index เองอยู่แล้ว)
+ALTER TABLE `field_point`
+  ADD KEY IF NOT EXISTS `ix_field_point_cover` (`field_id`,`point_order`,`latitude`,`longitude`),
+  DROP KEY IF EXISTS `field_id`;
+
+-- get_marks: WHERE zone_id ORDER BY tree_no, mark_id
+-- mark_id ต้องอยู่หลัง tree_no ตรง ๆ: PK ที่ InnoDB ต่อท้ายให้เองอยู่หลัง latitude/longitude จึงเรียงไม่ได้
+ALTER TABLE `mark_zone`
+  ADD KEY IF NOT EXISTS `ix_mark_zone_order` (`zone_id`,`tree_no`,`mark_id`,`latitude`,`longitude`),
+  DROP KEY IF EXISTS `ix_mark_zone_cover`,
+  DROP KEY IF EXISTS `zone_id`;
+
+-- get_zones_by_field / list_zones: WHERE field_id ORDER BY zone_name
+ALTER TABLE `zone`
+  ADD KEY IF NOT EXISTS `ix_zone_field_name` (`field_id`,`zone_name`),
+  DROP KEY IF EXISTS `field_id`;
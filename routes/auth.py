@@ -1,33 +1,80 @@
-from flask import Blueprint, request, jsonify, current_app
-from mysql.connector import Error
-from config.database import get_db_connection, hash_password
-import jwt, bcrypt
-from datetime import datetime, timedelta
+from flask import Blueprint, request, jsonify, current_app, Response
+from mysql.connector import Error, IntegrityError
+from mysql.connector.errorcode import ER_DUP_ENTRY
+from config.database import (
+    db_cursor, run_prepared, hash_password, verify_password, password_needs_rehash, legacy_sha256,
+)
+from config.tokens import encode_hs256, decode_token
+import os, jwt, bcrypt, time, threading, hmac, hashlib
+from functools import lru_cache
+from cachetools import TTLCache
+import orjson
 
 auth_bp = Blueprint('auth', __name__)
 
 # ==================== PASSWORD HELPERS ====================
-def _bcrypt_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+# bcrypt ใช้แค่ตรวจ hash เก่า (hash ใหม่เป็น argon2 ซึ่งไม่ต้อง gensalt) → bind ไว้ครั้งเดียว
+_CHECKPW = bcrypt.checkpw
 
 def _bcrypt_check(password: str, hashed: str) -> bool:
     try:
-        return bcrypt.checkpw(password.encode(), hashed.encode())
+        return _CHECKPW(password.encode(), hashed.encode())
     except Exception:
         return False
 
-# ==================== CORS HELPERS ====================
-def _add_cors(resp):
-    resp.headers.add('Access-Control-Allow-Origin', '*')
-    resp.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
-    resp.headers.add('Access-Control-Allow-Methods', 'POST, GET, PUT, DELETE, OPTIONS')
-    resp.headers.add('Access-Control-Allow-Credentials', 'true')
-    return resp
+# cache เฉพาะผล "ผ่าน" ของ (hash, password) ที่เพิ่งตรวจไป → login ซ้ำไม่ต้องคำนวณ argon2/bcrypt ใหม่
+# key เป็น HMAC ด้วย key สุ่มต่อ process จึงไม่มีรหัสผ่านหรือค่าที่ brute-force ได้ค้างใน memory
+# ผล "ไม่ผ่าน" ไม่ cache เพื่อให้การเดารหัสยังต้องจ่ายค่า hash เต็มทุกครั้ง
+_VERIFY_CACHE = TTLCache(maxsize=4096, ttl=300)
+_VERIFY_LOCK = threading.Lock()
+_VERIFY_KEY = os.urandom(32)
 
-def _preflight():
-    resp = jsonify({'status': 'OK'})
-    resp.status_code = 204
-    return _add_cors(resp)
+def _verify_cache_key(password: str, db_pass: str) -> bytes:
+    return hmac.new(_VERIFY_KEY, password.encode() + b"|" + db_pass.encode(), hashlib.sha256).digest()
+
+def _check_password(password: str, db_pass: str) -> bool:
+    """ตรวจรหัสผ่านกับค่าที่เก็บใน DB (ผ่าน cache ผลที่ตรวจผ่านแล้ว)"""
+    if not db_pass:
+        return False
+    key = _verify_cache_key(password, db_pass)
+    with _VERIFY_LOCK:
+        if _VERIFY_CACHE.get(key):
+            return True
+    ok = _check_password_uncached(password, db_pass)
+    if ok:
+        with _VERIFY_LOCK:
+            _VERIFY_CACHE[key] = True
+    return ok
+
+def _check_password_uncached(password: str, db_pass: str) -> bool:
+    """argon2 (ปัจจุบัน) + bcrypt/sha256/plain (legacy)"""
+    if db_pass.startswith("$argon2"):
+        return verify_password(db_pass, password)
+    if db_pass.startswith("$2b$") or db_pass.startswith("$2a$"):
+        return _bcrypt_check(password, db_pass)
+    # เทียบแบบ constant-time ทั้ง sha256 และ plain เก่า
+    if _is_sha256_hex(db_pass):
+        return hmac.compare_digest(db_pass.lower().encode(), legacy_sha256(password).encode())
+    return hmac.compare_digest(password.encode(), db_pass.encode())
+
+def _is_sha256_hex(value: str) -> bool:
+    # fromhex ตรวจ charset ใน C; เช็คความยาวผลลัพธ์ด้วยเพราะ fromhex ยอมให้มีช่องว่างคั่น
+    if len(value) != 64:
+        return False
+    try:
+        return len(bytes.fromhex(value)) == 32
+    except ValueError:
+        return False
+
+# ==================== TOKEN HELPERS ====================
+def _decode_token(token: str) -> dict:
+    """decode ผ่าน cache กลางใน config.tokens (ใช้ร่วมกับ field_zone / inspection)"""
+    return decode_token(token, current_app.config['JWT_SECRET_KEY'])
+
+@lru_cache(maxsize=4096)
+def _iso_local(epoch: int) -> str:
+    # เท่ากับ datetime.fromtimestamp(exp).isoformat() สำหรับ exp ที่เป็น int
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(epoch))
 
 def _get_payload():
     auth_header = request.headers.get('Authorization', '')
@@ -35,167 +82,151 @@ def _get_payload():
         return None
     token = auth_header.split(' ')[1]
     try:
-        return jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+        # ใช้ cache เดียวกับ /validate (key = token+secret; token ผูก HMAC อยู่แล้ว)
+        return _decode_token(token)
     except jwt.InvalidTokenError:
         return None
 
-def _user_exists(username=None, user_tel=None, exclude_user_id=None):
-    """เช็คซ้ำ username หรือเบอร์ (ยกเว้น user_id ของตัวเองเวลาปรับปรุงโปรไฟล์)"""
-    conn = get_db_connection()
-    if not conn:
-        return False
-    try:
-        cursor = conn.cursor()
-        clauses, params = [], []
-        if username:
-            clauses.append("username = %s")
-            params.append(username)
-        if user_tel:
-            clauses.append("user_tel = %s")
-            params.append(user_tel)
-        if not clauses:
-            return False
-        sql = "SELECT user_id FROM users WHERE (" + " OR ".join(clauses) + ")"
-        if exclude_user_id:
-            sql += " AND user_id <> %s"
-            params.append(exclude_user_id)
-        cursor.execute(sql, tuple(params))
-        return cursor.fetchone() is not None
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
 # ==================== AUTH CORE ====================
+_SQL_LOGIN_USER = "SELECT user_id, username, name, user_tel, user_password FROM users WHERE username = %s"
+_SQL_LOGIN_STAMP = "UPDATE users SET last_login_at = NOW() WHERE user_id = %s"
+_SQL_LOGIN_REHASH = (
+    "UPDATE users SET last_login_at = NOW(), "
+    "user_password = IF(user_password = %s, %s, user_password) WHERE user_id = %s"
+)
+
 def authenticate_user(username, password):
-    conn = get_db_connection()
-    if not conn:
+    # SELECT คงที่ → prepared statement ที่ค้างไว้ต่อ connection (ไม่ต้อง CALL + อ่านหลาย result set)
+    with db_cursor(dict=False) as (cur, conn):
+        rows = run_prepared(conn, _SQL_LOGIN_USER, (username,))
+    if not rows:
         return None
-    try:
-        cur = conn.cursor(dictionary=True)
-        cur.execute("""
-            SELECT user_id, username, name, user_tel, user_password
-            FROM users WHERE username=%s
-        """, (username,))
-        user = cur.fetchone()
-        if not user:
-            return None
-
-        db_pass = user["user_password"]
-
-        # ✅ case 1: bcrypt
-        if db_pass.startswith("$2b$") or db_pass.startswith("$2a$"):
-            if _bcrypt_check(password, db_pass):
-                return user
-            return None
-
-        # ✅ case 2: sha256 legacy
-        if len(db_pass) == 64 and all(c in "0123456789abcdef" for c in db_pass.lower()):
-            if db_pass == hash_password(password):
-                # migrate เป็น bcrypt
-                new_hash = _bcrypt_hash(password)
-                cur.execute("UPDATE users SET user_password=%s WHERE user_id=%s", (new_hash, user["user_id"]))
-                conn.commit()
-                return user
-            return None
-
-        # ✅ case 3: plain legacy
-        if password == db_pass:
-            new_hash = _bcrypt_hash(password)
-            cur.execute("UPDATE users SET user_password=%s WHERE user_id=%s", (new_hash, user["user_id"]))
-            conn.commit()
-            return user
+    row = rows[0]
 
+    # ตรวจ hash นอก with เพื่อไม่ถือ connection ของ pool ระหว่างคำนวณ argon2 (~50 ms ต่อครั้ง)
+    # จึงยืม connection 2 รอบ (SELECT / UPDATE หลังรหัสถูก): การยืมจาก pool ไม่มี round-trip
+    # แต่ถ้าถือไว้ตลอด การเดารหัสรัว ๆ จะกิน pool จนทุก route ต้องรอ
+    user_id, uname, name, user_tel, db_pass = row
+    if not _check_password(password, db_pass):
         return None
-    finally:
-        if conn.is_connected():
-            cur.close()
-            conn.close()
+
+    # ✅ migrate hash เก่า (bcrypt/sha256/plain หรือ argon2 พารามิเตอร์เก่า) เป็น argon2id
+    # รวมกับ stamp last_login_at เป็น UPDATE เดียว
+    new_hash = hash_password(password) if password_needs_rehash(db_pass) else None
+    with db_cursor(dict=False, prepared=True) as (cur, conn):
+        if new_hash:
+            # guard ด้วย hash เดิม: login พร้อมกันหลายครั้งจะเขียนทับแค่ครั้งแรก และไม่ทับรหัสที่เพิ่งเปลี่ยน
+            cur.execute(_SQL_LOGIN_REHASH, (db_pass, new_hash, user_id))
+        else:
+            cur.execute(_SQL_LOGIN_STAMP, (user_id,))
+    return {'user_id': user_id, 'username': uname, 'name': name, 'user_tel': user_tel}
+
+# sentinel: username หรือเบอร์โทรซ้ำ (ชน UNIQUE key)
+DUPLICATE = object()
 
 def register_user(username, user_tel, password, name):
-    conn = get_db_connection()
-    if not conn:
-        return None
+    """คืน user_id ใหม่, DUPLICATE ถ้าซ้ำ, หรือ None ถ้าเกิดข้อผิดพลาด"""
+    hashed = hash_password(password)  # ✅ always argon2id
     try:
-        cur = conn.cursor()
-        hashed = _bcrypt_hash(password)  # ✅ always bcrypt
-        cur.execute("""
-            INSERT INTO users (username, user_tel, user_password, name)
-            VALUES (%s,%s,%s,%s)
-        """, (username, user_tel, hashed, name))
-        conn.commit()
-        return cur.lastrowid
+        with db_cursor(dict=False) as (cur, conn):
+            cur.execute("""
+                INSERT INTO users (username, user_tel, user_password, name)
+                VALUES (%s,%s,%s,%s)
+            """, (username, user_tel, hashed, name))
+            return cur.lastrowid
+    except IntegrityError as e:
+        # ชน uk_username / uk_user_tel
+        if e.errno == ER_DUP_ENTRY:
+            return DUPLICATE
+        current_app.logger.error("Registration error: %s", e)
+        return None
     except Error as e:
-        current_app.logger.error(f"Registration error: {e}")
-        conn.rollback()
+        current_app.logger.error("Registration error: %s", e)
         return None
-    finally:
-        if conn.is_connected():
-            cur.close()
-            conn.close()
 
 def generate_token(user_data):
-    now = datetime.utcnow()
+    now = int(time.time())
     payload = {
         'user_id': user_data['user_id'],
         'username': user_data['username'],
         'name': user_data.get('name', ''),
-        'exp': now + timedelta(days=30),
+        'exp': now + current_app.config.get('JWT_EXPIRY_DAYS', 30) * 86400,
         'iat': now
     }
-    return jwt.encode(payload, current_app.config['JWT_SECRET_KEY'], algorithm='HS256')
+    return encode_hs256(payload, current_app.config['JWT_SECRET_KEY'])
+
+# ---------- /validate response ----------
+_ORJSON_OPTS = orjson.OPT_NON_STR_KEYS
+
+def _no_store_json(payload: dict, status: int) -> Response:
+    # serialize ด้วย orjson ครั้งเดียว + no-store กัน proxy/เบราว์เซอร์เก็บผล 200/401 เก่าไว้
+    return Response(orjson.dumps(payload, option=_ORJSON_OPTS), status=status,
+                    mimetype='application/json', headers={'Cache-Control': 'no-store'})
+
+# ---------- register validation ----------
+# (ตัวตรวจ, error code, ข้อความ) เรียงตามลำดับเดิม → คืนตัวแรกที่ไม่ผ่าน
+_REGISTER_RULES = (
+    (lambda u, t, p, c: len(u) >= 3, 'username_too_short', 'ชื่อผู้ใช้ต้องมีอย่างน้อย 3 ตัวอักษร'),
+    (lambda u, t, p, c: len(t) >= 10, 'phone_invalid', 'เบอร์โทรศัพท์ไม่ถูกต้อง'),
+    (lambda u, t, p, c: p == c, 'password_mismatch', 'รหัสผ่านไม่ตรงกัน'),
+    (lambda u, t, p, c: len(p) >= 6, 'password_too_short', 'รหัสผ่านต้องมีอย่างน้อย 6 ตัวอักษร'),
+)
+
+def _first_register_error(username, user_tel, password, confirm):
+    for ok, code, msg in _REGISTER_RULES:
+        if not ok(username, user_tel, password, confirm):
+            return code, msg
+    return None
 
 # ==================== ROUTES ====================
-@auth_bp.route('/login', methods=['POST', 'OPTIONS'])
+@auth_bp.route('/login', methods=['POST'])
 def login():
-    if request.method == 'OPTIONS':
-        return _preflight()
     try:
         data = request.get_json(silent=True) or request.form
         username = (data.get('username') or '').strip()
         password = (data.get('password') or '').strip()
 
         if not username or not password:
-            return _add_cors(jsonify({
+            return jsonify({
                 'success': False,
                 'error': 'missing_fields',
                 'message': 'กรุณากรอกชื่อผู้ใช้และรหัสผ่าน'
-            })), 400
+            }), 400
 
         user = authenticate_user(username, password)
         if not user:
-            return _add_cors(jsonify({
+            return jsonify({
                 'success': False,
                 'error': 'invalid_credentials',
                 'message': 'ชื่อผู้ใช้หรือรหัสผ่านไม่ถูกต้อง'
-            })), 401
-
-        token = generate_token(user)
-        current_app.logger.info(f"Login successful for user: {username}")
-        return _add_cors(jsonify({
+            }), 401
+
+        # payload เดียว: user_public ใช้ทั้งสร้าง token และส่งกลับ (ไม่มี hash รหัสผ่านติดไป)
+        user_public = {
+            'user_id': user['user_id'],
+            'username': user['username'],
+            'name': user.get('name') or '',
+            'user_tel': user.get('user_tel')
+        }
+        token = generate_token(user_public)
+        current_app.logger.info("Login successful for user: %s", username)
+        return jsonify({
             'success': True,
             'message': 'เข้าสู่ระบบสำเร็จ',
-            'user': {
-                'user_id': user['user_id'],
-                'username': user['username'],
-                'name': user.get('name', ''),
-                'user_tel': user.get('user_tel')
-            },
+            'user': user_public,
             'token': token,
-            'expires_in_days': 30
-        })), 200
+            'expires_in_days': current_app.config.get('JWT_EXPIRY_DAYS', 30)
+        }), 200
     except Exception as e:
-        current_app.logger.error(f"Login error: {e}")
-        return _add_cors(jsonify({
+        current_app.logger.error("Login error: %s", e)
+        return jsonify({
             'success': False,
             'error': 'server_error',
             'message': 'เกิดข้อผิดพลาดในระบบ'
-        })), 500
+        }), 500
 
-@auth_bp.route('/register', methods=['POST', 'OPTIONS'])
+@auth_bp.route('/register', methods=['POST'])
 def register():
-    if request.method == 'OPTIONS':
-        return _preflight()
     try:
         data = request.get_json(silent=True) or request.form
         username = (data.get('username') or '').strip()
@@ -205,52 +236,43 @@ def register():
         name = (data.get('name') or '').strip()
 
         if not all([username, user_tel, password, confirm, name]):
-            return _add_cors(jsonify({
+            return jsonify({
                 'success': False,
                 'error': 'missing_fields',
                 'message': 'กรุณากรอกข้อมูลให้ครบทุกช่อง'
-            })), 400
-        if len(username) < 3:
-            return _add_cors(jsonify({'success': False, 'error': 'username_too_short', 'message': 'ชื่อผู้ใช้ต้องมีอย่างน้อย 3 ตัวอักษร'})), 400
-        if len(user_tel) < 10:
-            return _add_cors(jsonify({'success': False, 'error': 'phone_invalid', 'message': 'เบอร์โทรศัพท์ไม่ถูกต้อง'})), 400
-        if password != confirm:
-            return _add_cors(jsonify({'success': False, 'error': 'password_mismatch', 'message': 'รหัสผ่านไม่ตรงกัน'})), 400
-        if len(password) < 6:
-            return _add_cors(jsonify({'success': False, 'error': 'password_too_short', 'message': 'รหัสผ่านต้องมีอย่างน้อย 6 ตัวอักษร'})), 400
-        if _user_exists(username=username, user_tel=user_tel):
-            return _add_cors(jsonify({'success': False, 'error': 'user_exists', 'message': 'ชื่อผู้ใช้หรือเบอร์โทรศัพท์นี้มีอยู่แล้ว'})), 409
+            }), 400
+        failed = _first_register_error(username, user_tel, password, confirm)
+        if failed:
+            return jsonify({'success': False, 'error': failed[0], 'message': failed[1]}), 400
 
         new_id = register_user(username, user_tel, password, name)
+        if new_id is DUPLICATE:
+            return jsonify({'success': False, 'error': 'user_exists', 'message': 'ชื่อผู้ใช้หรือเบอร์โทรศัพท์นี้มีอยู่แล้ว'}), 409
         if not new_id:
-            return _add_cors(jsonify({'success': False, 'error': 'registration_failed', 'message': 'เกิดข้อผิดพลาดในการลงทะเบียน'})), 500
+            return jsonify({'success': False, 'error': 'registration_failed', 'message': 'เกิดข้อผิดพลาดในการลงทะเบียน'}), 500
 
-        return _add_cors(jsonify({
+        return jsonify({
             'success': True,
             'message': 'ลงทะเบียนสำเร็จ!',
             'data': {'user_id': new_id, 'username': username, 'name': name}
-        })), 201
+        }), 201
     except Exception as e:
-        current_app.logger.error(f"Registration error: {e}")
-        return _add_cors(jsonify({'success': False, 'error': 'server_error', 'message': 'เกิดข้อผิดพลาดในระบบ'})), 500
+        current_app.logger.error("Registration error: %s", e)
+        return jsonify({'success': False, 'error': 'server_error', 'message': 'เกิดข้อผิดพลาดในระบบ'}), 500
 
-@auth_bp.route('/logout', methods=['POST', 'OPTIONS'])
+@auth_bp.route('/logout', methods=['POST'])
 def logout():
-    if request.method == 'OPTIONS':
-        return _preflight()
-    return _add_cors(jsonify({'success': True, 'message': 'ออกจากระบบเรียบร้อยแล้ว'})), 200
+    return jsonify({'success': True, 'message': 'ออกจากระบบเรียบร้อยแล้ว'}), 200
 
-@auth_bp.route('/validate', methods=['GET', 'OPTIONS'])
+@auth_bp.route('/validate', methods=['GET'])
 def validate():
-    if request.method == 'OPTIONS':
-        return _preflight()
     auth = request.headers.get('Authorization', '')
     if not auth.startswith('Bearer '):
-        return _add_cors(jsonify({'success': False, 'authenticated': False, 'error': 'missing_token', 'message': 'Token is required'})), 401
+        return _no_store_json({'success': False, 'authenticated': False, 'error': 'missing_token', 'message': 'Token is required'}, 401)
     token = auth.split(' ')[1]
     try:
-        payload = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-        return _add_cors(jsonify({
+        payload = _decode_token(token)
+        return _no_store_json({
             'success': True,
             'authenticated': True,
             'user': {
@@ -258,36 +280,29 @@ def validate():
                 'username': payload['username'],
                 'name': payload.get('name', '')
             },
-            'token_expires': datetime.fromtimestamp(payload['exp']).isoformat()
-        })), 200
+            'token_expires': _iso_local(payload['exp'])
+        }, 200)
     except jwt.ExpiredSignatureError:
-        return _add_cors(jsonify({'success': False, 'authenticated': False, 'error': 'token_expired', 'message': 'Token has expired'})), 401
+        return _no_store_json({'success': False, 'authenticated': False, 'error': 'token_expired', 'message': 'Token has expired'}, 401)
     except jwt.InvalidTokenError:
-        return _add_cors(jsonify({'success': False, 'authenticated': False, 'error': 'invalid_token', 'message': 'Token is invalid'})), 401
+        return _no_store_json({'success': False, 'authenticated': False, 'error': 'invalid_token', 'message': 'Token is invalid'}, 401)
 
 # ---------- Profile ----------
-@auth_bp.route('/profile', methods=['GET', 'PUT', 'OPTIONS'])
+@auth_bp.route('/profile', methods=['GET', 'PUT'])
 def profile():
-    if request.method == 'OPTIONS':
-        return _preflight()
-
     payload = _get_payload()
     if not payload:
-        return _add_cors(jsonify({'success': False, 'error': 'unauthorized', 'message': 'Authentication required'})), 401
+        return jsonify({'success': False, 'error': 'unauthorized', 'message': 'Authentication required'}), 401
 
     user_id = payload['user_id']
-    conn = get_db_connection()
-    if not conn:
-        return _add_cors(jsonify({'success': False, 'error': 'db_failed', 'message': 'Database connection failed'})), 500
-
     try:
-        cur = conn.cursor(dictionary=True)
         if request.method == 'GET':
-            cur.execute("SELECT user_id, username, name, user_tel FROM users WHERE user_id = %s", (user_id,))
-            row = cur.fetchone()
+            with db_cursor(dict=True, commit=False) as (cur, conn):
+                cur.execute("SELECT user_id, username, name, user_tel FROM users WHERE user_id = %s", (user_id,))
+                row = cur.fetchone()
             if not row:
-                return _add_cors(jsonify({'success': False, 'error': 'not_found', 'message': 'User not found'})), 404
-            return _add_cors(jsonify({'success': True, 'data': row})), 200
+                return jsonify({'success': False, 'error': 'not_found', 'message': 'User not found'}), 404
+            return jsonify({'success': True, 'data': row}), 200
 
         # PUT: update profile
         data = request.get_json(silent=True) or {}
@@ -296,10 +311,7 @@ def profile():
         user_tel = (data.get('user_tel') or '').strip()
 
         if not any([username, name, user_tel]):
-            return _add_cors(jsonify({'success': False, 'error': 'nothing_to_update', 'message': 'ไม่มีข้อมูลสำหรับอัปเดต'})), 400
-
-        if (username or user_tel) and _user_exists(username=username or None, user_tel=user_tel or None, exclude_user_id=user_id):
-            return _add_cors(jsonify({'success': False, 'error': 'duplicate', 'message': 'ชื่อผู้ใช้หรือเบอร์โทรซ้ำกับผู้ใช้อื่น'})), 409
+            return jsonify({'success': False, 'error': 'nothing_to_update', 'message': 'ไม่มีข้อมูลสำหรับอัปเดต'}), 400
 
         fields, params = [], []
         if username:
@@ -311,32 +323,32 @@ def profile():
         params.append(user_id)
 
         sql = "UPDATE users SET " + ", ".join(fields) + " WHERE user_id = %s"
-        cur.execute(sql, tuple(params))
-        conn.commit()
-        return _add_cors(jsonify({'success': True, 'message': 'อัปเดตโปรไฟล์สำเร็จ'})), 200
+        with db_cursor(dict=False) as (cur, conn):
+            cur.execute(sql, tuple(params))
+        return jsonify({'success': True, 'message': 'อัปเดตโปรไฟล์สำเร็จ'}), 200
+    except IntegrityError as e:
+        # UNIQUE key ตัดสินเรื่องซ้ำเอง ไม่ต้อง SELECT เช็คก่อน (และไม่มี race ระหว่างเช็คกับเขียน)
+        if e.errno == ER_DUP_ENTRY:
+            return jsonify({'success': False, 'error': 'duplicate', 'message': 'ชื่อผู้ใช้หรือเบอร์โทรซ้ำกับผู้ใช้อื่น'}), 409
+        current_app.logger.error("Profile update error: %s", e)
+        return jsonify({'success': False, 'error': 'db_error', 'message': str(e)}), 500
+    except RuntimeError:
+        return jsonify({'success': False, 'error': 'db_failed', 'message': 'Database connection failed'}), 500
     except Error as e:
-        conn.rollback()
-        current_app.logger.error(f"Profile update error: {e}")
-        return _add_cors(jsonify({'success': False, 'error': 'db_error', 'message': str(e)})), 500
-    finally:
-        if conn.is_connected():
-            cur.close()
-            conn.close()
+        current_app.logger.error("Profile update error: %s", e)
+        return jsonify({'success': False, 'error': 'db_error', 'message': str(e)}), 500
 
 # ---------- Change Password ----------
-@auth_bp.route('/profile/password', methods=['PUT', 'OPTIONS'])
-@auth_bp.route('/change-password', methods=['PUT', 'OPTIONS'])
+@auth_bp.route('/profile/password', methods=['PUT'])
+@auth_bp.route('/change-password', methods=['PUT'])
 def change_password():
-    if request.method == 'OPTIONS':
-        return _preflight()
-
     payload = _get_payload()
     if not payload:
-        return _add_cors(jsonify({
+        return jsonify({
             'success': False,
             'error': 'unauthorized',
             'message': 'Authentication required'
-        })), 401
+        }), 401
 
     data = (request.get_json(silent=True) or request.form or {})
     current_password = (data.get('current_password') or data.get('old_password') or '').strip()
@@ -344,49 +356,34 @@ def change_password():
     confirm_password = (data.get('confirm_password') or data.get('password_confirmation') or new_password).strip()
 
     if not current_password or not new_password:
-        return _add_cors(jsonify({'success': False, 'error': 'missing_fields', 'message': 'กรุณากรอกข้อมูลให้ครบ'})), 400
+        return jsonify({'success': False, 'error': 'missing_fields', 'message': 'กรุณากรอกข้อมูลให้ครบ'}), 400
     if new_password != confirm_password:
-        return _add_cors(jsonify({'success': False, 'error': 'password_mismatch', 'message': 'รหัสผ่านใหม่ไม่ตรงกัน'})), 400
+        return jsonify({'success': False, 'error': 'password_mismatch', 'message': 'รหัสผ่านใหม่ไม่ตรงกัน'}), 400
     if len(new_password) < 6:
-        return _add_cors(jsonify({'success': False, 'error': 'password_too_short', 'message': 'รหัสผ่านต้องมีอย่างน้อย 6 ตัวอักษร'})), 400
+        return jsonify({'success': False, 'error': 'password_too_short', 'message': 'รหัสผ่านต้องมีอย่างน้อย 6 ตัวอักษร'}), 400
 
     user_id = payload['user_id']
-    conn = get_db_connection()
-    if not conn:
-        return _add_cors(jsonify({'success': False, 'error': 'db_failed', 'message': 'Database connection failed'})), 500
-
     try:
-        cur = conn.cursor(dictionary=True)
-        cur.execute("SELECT user_password FROM users WHERE user_id=%s", (user_id,))
-        row = cur.fetchone()
+        with db_cursor(dict=False, commit=False, prepared=True) as (cur, conn):
+            cur.execute("SELECT user_password FROM users WHERE user_id=%s", (user_id,))
+            row = cur.fetchone()
         if not row:
-            return _add_cors(jsonify({'success': False, 'error': 'not_found', 'message': 'User not found'})), 404
-
-        db_pass = row["user_password"]
+            return jsonify({'success': False, 'error': 'not_found', 'message': 'User not found'}), 404
 
-        # verify old password (bcrypt + legacy)
-        valid = False
-        if db_pass.startswith("$2b$") and _bcrypt_check(current_password, db_pass):
-            valid = True
-        elif len(db_pass) == 64 and db_pass == hash_password(current_password):
-            valid = True
-        elif current_password == db_pass:
-            valid = True
+        db_pass, = row
 
-        if not valid:
-            return _add_cors(jsonify({'success': False, 'error': 'wrong_password', 'message': 'รหัสผ่านเดิมไม่ถูกต้อง'})), 400
+        # verify old password (argon2 + legacy)
+        if not _check_password(current_password, db_pass):
+            return jsonify({'success': False, 'error': 'wrong_password', 'message': 'รหัสผ่านเดิมไม่ถูกต้อง'}), 400
 
-        # update new password with bcrypt
-        new_hash = _bcrypt_hash(new_password)
-        cur.execute("UPDATE users SET user_password=%s WHERE user_id=%s", (new_hash, user_id))
-        conn.commit()
+        # update new password with argon2id
+        new_hash = hash_password(new_password)
+        with db_cursor(dict=False, prepared=True) as (cur, conn):
+            cur.execute("UPDATE users SET user_password=%s WHERE user_id=%s", (new_hash, user_id))
 
-        return _add_cors(jsonify({'success': True, 'message': 'เปลี่ยนรหัสผ่านสำเร็จ'})), 200
+        return jsonify({'success': True, 'message': 'เปลี่ยนรหัสผ่านสำเร็จ'}), 200
+    except RuntimeError:
+        return jsonify({'success': False, 'error': 'db_failed', 'message': 'Database connection failed'}), 500
     except Error as e:
-        conn.rollback()
-        current_app.logger.error(f"Change password error: {e}")
-        return _add_cors(jsonify({'success': False, 'error': 'db_error', 'message': str(e)})), 500
-    finally:
-        if conn.is_connected():
-            cur.close()
-            conn.close()
+        current_app.logger.error("Change password error: %s", e)
+        return jsonify({'success': False, 'error': 'db_error', 'message': str(e)}), 500
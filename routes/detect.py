@@ -1,6 +1,9 @@
 # routes/detect.py
 from flask import Blueprint, request, jsonify, current_app
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
@@ -8,7 +11,14 @@ bp_detect = Blueprint('detect', __name__)
 
 _MODEL = None
 _MODEL_NAMES = None
+_MODEL_NAMES_LIST: List[str] = []  # names เรียงตาม cls_id (id ของ YOLO ต่อเนื่อง 0..N-1)
 _DEVICE = None  # เก็บ device ที่เลือกไว้
+_HALF = False    # FP16 เฉพาะตอนรันบน GPU
+_IMGSZ = int(os.environ.get('YOLO_IMGSZ', '640'))  # อ่าน env ครั้งเดียวตอน import
+_MODEL_LOCK = threading.Lock()
+_BATCH = max(1, int(os.environ.get('YOLO_BATCH', '8')))  # จำนวนรูปต่อรอบ predict
+_READ_AHEAD = 2 * _BATCH  # จำนวนรูปที่อ่านล่วงหน้าได้สูงสุดต่อ request
+_IO_POOL = ThreadPoolExecutor(max_workers=int(os.environ.get('YOLO_IO_WORKERS', '4')), thread_name_prefix='yolo-io')
 
 # ---------- utils: device ----------
 def _pick_device() -> str:
@@ -46,19 +56,44 @@ def _pick_model_path(app_root: Path) -> Optional[str]:
     ]
     for p in candidates:
         if p and Path(p).exists():
-            current_app.logger.info(f"[DETECT] ✔ Using model file: {p}")
+            current_app.logger.info("[DETECT] ✔ Using model file: %s", p)
             return p
     for p in candidates:
         if p:
-            current_app.logger.warning(f"[DETECT] ✗ Not found: {p}")
+            current_app.logger.warning("[DETECT] ✗ Not found: %s", p)
     return None
 
 # ---------- model loader ----------
+def _engine_path_for(model_path: str) -> Optional[str]:
+    """YOLO_TRT_ENGINE=1: export .pt → TensorRT .engine (FP16) ไว้ข้าง ๆ ครั้งแรก แล้วใช้ไฟล์นั้นต่อ"""
+    if (os.environ.get('YOLO_TRT_ENGINE') or '').strip().lower() not in ('1', 'true', 'yes'):
+        return None
+    if _DEVICE == 'cpu' or not model_path.endswith('.pt'):
+        return None
+    engine_path = model_path[:-3] + '.engine'
+    if os.path.exists(engine_path):
+        return engine_path
+    try:
+        from ultralytics import YOLO
+        current_app.logger.info("[DETECT] Exporting TensorRT engine: %s", engine_path)
+        return YOLO(model_path).export(format='engine', half=True, device=_DEVICE,
+                                       imgsz=_IMGSZ)
+    except Exception as e:
+        # ไม่มี TensorRT ในเครื่อง → ใช้ .pt แบบ FP16 ต่อไป
+        current_app.logger.warning("[DETECT] TensorRT export failed, using .pt: %s", e)
+        return None
+
 def _load_model():
-    global _MODEL, _MODEL_NAMES, _DEVICE
     if _MODEL is not None:
         return _MODEL
+    # warmup thread ตอน start กับ request แรกอาจเข้ามาพร้อมกัน → โหลดครั้งเดียว
+    with _MODEL_LOCK:
+        if _MODEL is None:
+            _load_model_locked()
+    return _MODEL
 
+def _load_model_locked():
+    global _MODEL, _MODEL_NAMES, _MODEL_NAMES_LIST, _DEVICE, _HALF
     from ultralytics import YOLO
 
     app_root = Path(current_app.root_path).resolve()
@@ -66,44 +101,97 @@ def _load_model():
     if not model_path:
         msg = ("No model file found. Please set ENV MODEL_PATH or put model at "
                "`config/model/best.pt` (or `best(1).pt`).")
-        current_app.logger.error(f"[DETECT] {msg}")
+        current_app.logger.error("[DETECT] %s", msg)
         raise FileNotFoundError(msg)
 
     _DEVICE = _pick_device()
-    current_app.logger.info(f"[DETECT] Loading YOLO: {model_path} | device={_DEVICE}")
+    _HALF = _DEVICE != 'cpu'
+    model_path = _engine_path_for(model_path) or model_path
+    current_app.logger.info("[DETECT] Loading YOLO: %s | device=%s | half=%s", model_path, _DEVICE, _HALF)
     m = YOLO(model_path)
+    if _HALF and model_path.endswith('.pt'):
+        # รวม Conv+BN ครั้งเดียวตอนโหลด; น้ำหนักแปลงเป็น FP16 ผ่าน half=True ตอน predict
+        m.fuse()
+    _warmup(m)
     _MODEL = m
     _MODEL_NAMES = getattr(m, 'names', None)
+    if isinstance(_MODEL_NAMES, dict) and sorted(_MODEL_NAMES) == list(range(len(_MODEL_NAMES))):
+        _MODEL_NAMES_LIST = [str(_MODEL_NAMES[i]) for i in range(len(_MODEL_NAMES))]
     current_app.logger.info(
-        f"[DETECT] YOLO loaded OK | classes="
-        f"{len(_MODEL_NAMES) if isinstance(_MODEL_NAMES, dict) else _MODEL_NAMES}"
+        "[DETECT] YOLO loaded OK | classes=%s",
+        len(_MODEL_NAMES) if isinstance(_MODEL_NAMES, dict) else _MODEL_NAMES,
     )
-    return _MODEL
+
+def _warmup(m):
+    """predict ภาพดำ 1 รูป: สร้าง predictor, CUDA context และ cuDNN autotune ก่อน request จริง"""
+    try:
+        import numpy as np
+        if _DEVICE != 'cpu':
+            import torch
+            torch.backends.cudnn.benchmark = True  # ขนาดภาพคงที่ (_IMGSZ) → autotune คุ้ม
+        m.predict(np.zeros((_IMGSZ, _IMGSZ, 3), dtype=np.uint8),
+                  verbose=False, imgsz=_IMGSZ, device=_DEVICE, half=_HALF)
+    except Exception as e:
+        current_app.logger.warning("[DETECT] warmup skipped: %s", e)
 
 def _class_name_from_id(idx: int) -> str:
+    if 0 <= idx < len(_MODEL_NAMES_LIST):
+        return _MODEL_NAMES_LIST[idx]
     if isinstance(_MODEL_NAMES, dict):
         return _MODEL_NAMES.get(idx, str(idx))
     return str(idx)
 
 # ---------- core predict ----------
+def _imread(path: str):
+    import cv2  # มากับ ultralytics; imread ปล่อย GIL ระหว่างอ่าน/ถอดรหัส
+    return cv2.imread(path)
+
+def _predict_chunks(model, abs_paths: List[str], conf_thres: float):
+    """อ่าน+decode รูปล่วงหน้าใน thread pool ขณะที่โมเดลกำลังรัน chunk ก่อนหน้า
+    อ่านล่วงหน้าไม่เกิน _READ_AHEAD รูป: batch ใหญ่ไม่ถือภาพที่ decode แล้วทั้งหมดใน RAM
+    และไม่ยึด _IO_POOL (ใช้ร่วมทุก request) จน request อื่นต้องรอคิว"""
+    paths_iter = iter(abs_paths)
+    pending = deque()  # (path, future) ที่ส่งเข้า pool แล้ว เรียงตามลำดับเดิม
+
+    def _fill():
+        while len(pending) < _READ_AHEAD:
+            p = next(paths_iter, None)
+            if p is None:
+                return
+            pending.append((p, _IO_POOL.submit(_imread, p)))
+
+    _fill()
+    while pending:
+        chunk = [pending.popleft() for _ in range(min(_BATCH, len(pending)))]
+        _fill()  # ส่ง chunk ถัดไปเข้า pool ก่อน predict chunk นี้ → IO ยังซ้อนกับโมเดลเหมือนเดิม
+        paths = [p for p, _ in chunk]
+        imgs = [f.result() for _, f in chunk]
+        # อ่านไม่ได้สักรูป → ส่ง path ให้ ultralytics จัดการ/raise error เหมือนเดิม
+        source = paths if any(im is None for im in imgs) else imgs
+        yield from zip(paths, model.predict(
+            source,
+            verbose=False,
+            conf=conf_thres,
+            imgsz=_IMGSZ,
+            device=_DEVICE,
+            half=_HALF,
+        ))
+
 def predict_on_paths(abs_paths: List[str], conf_thres: float = 0.25) -> List[Dict[str, Any]]:
     model = _load_model()
-    results = model.predict(
-        abs_paths,
-        verbose=False,
-        conf=conf_thres,
-        imgsz=int(os.environ.get('YOLO_IMGSZ', '640')),
-        device=_DEVICE,
-    )
-
     out: List[Dict[str, Any]] = []
-    for img_path, r in zip(abs_paths, results):
+    for img_path, r in _predict_chunks(model, abs_paths, conf_thres):
         preds = []
         if hasattr(r, 'boxes') and r.boxes is not None and len(r.boxes) > 0:
-            for b in r.boxes:
-                cls_id = int(b.cls[0].item()) if hasattr(b.cls[0], 'item') else int(b.cls[0])
-                conf   = float(b.conf[0].item()) if hasattr(b.conf[0], 'item') else float(b.conf[0])
-                preds.append({'class': _class_name_from_id(cls_id), 'confidence': conf})
+            # ดึง conf/cls ของทุกกล่องในรูปเดียวลง CPU ครั้งเดียว แทน .item() ทีละกล่อง (sync GPU ทุกตัว)
+            # ใช้ boxes.conf/.cls ไม่ใช่ boxes.data[:, 4:6]: data มีคอลัมน์ track id แทรกได้ ตำแหน่งเลื่อน
+            boxes = r.boxes
+            rows = zip(boxes.conf.tolist(), boxes.cls.tolist())
+            if _MODEL_NAMES_LIST:
+                names = _MODEL_NAMES_LIST  # cls_id มาจากโมเดลเดียวกัน → index ตรงได้เลย
+                preds = [{'class': names[int(cls_id)], 'confidence': conf} for conf, cls_id in rows]
+            else:
+                preds = [{'class': _class_name_from_id(int(cls_id)), 'confidence': conf} for conf, cls_id in rows]
         elif hasattr(r, 'probs') and r.probs is not None:
             import torch
             probs = r.probs
@@ -113,6 +201,23 @@ def predict_on_paths(abs_paths: List[str], conf_thres: float = 0.25) -> List[Dic
         out.append({'image': img_path, 'preds': preds})
     return out
 
+# ---------- startup warmup ----------
+@bp_detect.record_once
+def _warm_on_register(state):
+    # YOLO_WARMUP=0 ปิดได้ (เช่นตอน dev ที่ไม่มีไฟล์โมเดล); โหลดใน thread แยกเพื่อไม่ถ่วงการ boot
+    if (os.environ.get('YOLO_WARMUP', '1') or '').strip().lower() in ('0', 'false', 'no'):
+        return
+    app = state.app
+
+    def _run():
+        with app.app_context():
+            try:
+                _load_model()
+            except Exception as e:
+                app.logger.warning("[DETECT] startup model load failed: %s", e)
+
+    threading.Thread(target=_run, name='yolo-warmup', daemon=True).start()
+
 # ---------- routes ----------
 @bp_detect.route('/labels', methods=['GET'])
 def labels():
@@ -129,17 +234,18 @@ def labels():
 def detect_batch():
     data = request.get_json(silent=True) or {}
     items = data.get('images') or data.get('paths') or []
-    conf  = float(data.get('conf') or 0.25)
     if not isinstance(items, list) or not items:
         return jsonify({'success': False, 'error': 'no_images'}), 400
+    # ไม่ใช้ `or 0.25`: conf=0 (ขอทุกกล่อง) เป็นค่าที่ตั้งใจส่งมา ไม่ใช่ค่าว่าง
+    conf = data.get('conf')
+    try:
+        conf = 0.25 if conf is None or conf == '' else float(conf)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'invalid_conf'}), 400
 
-    root = _uploads_root()
-    abs_paths = []
-    for p in items:
-        P = Path(str(p))
-        if not P.is_absolute():
-            P = (root / P).resolve()
-        abs_paths.append(str(P))
+    # join + normpath เป็นงาน string ล้วน ไม่ stat ทุก parent แบบ resolve(); ไฟล์ถูก stat ครั้งเดียวตอนเปิดอ่าน
+    root = str(_uploads_root())
+    abs_paths = [os.path.normpath(os.path.join(root, str(p))) for p in items]
 
     try:
         results = predict_on_paths(abs_paths, conf_thres=conf)
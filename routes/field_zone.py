@@ -1,50 +1,167 @@
 # routes/field_zone.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, g
 from mysql.connector import Error
-from config.database import get_db_connection
-import jwt
-import json
-from decimal import Decimal, InvalidOperation
+from config.database import get_db_connection, run_prepared, bulk_insert
+from config.tokens import bearer_payload
+import math
+from functools import wraps
+import threading
+import orjson
+from cachetools import TTLCache
 
 field_zone_bp = Blueprint('field_zone', __name__)
 
 # ==================== HELPER FUNCTIONS ====================
 
 def get_current_user():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return None
-    token = auth_header.split(' ')[1]
-    try:
-        payload = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-        return payload
-    except jwt.InvalidTokenError:
-        return None
+    # cache กลาง (config.tokens): token ที่เคยตรวจแล้วไม่ต้องทำ HMAC + JSON parse ซ้ำทุก request
+    # ภายใน request เดียวกันจำไว้ที่ g (เรียกซ้ำไม่ต้อง hash token ใหม่)
+    if '_jwt_user' not in g:
+        g._jwt_user = bearer_payload(request.headers.get('Authorization'), current_app.config['JWT_SECRET_KEY'])
+    return g._jwt_user
+
+@field_zone_bp.before_request
+def _skip_preflight():
+    # CORS preflight ตอบ 204 ตรงนี้เลย (header มาจาก flask-cors ใน after_request) ไม่ต้องเข้า handler
+    if request.method == 'OPTIONS':
+        return current_app.make_default_options_response()
+
+# body ของ 401 คงที่ → serialize ครั้งเดียวตอน import
+# (สร้าง Response ใหม่ทุกครั้ง: ใช้ object เดียวร่วมกันไม่ได้ เพราะ flask-cors เติม header ตาม origin ของแต่ละ request)
+_UNAUTH_BODY = orjson.dumps(
+    {'error': 'unauthorized', 'message': 'Authentication required', 'success': False}
+)
 
 def require_auth():
-    if request.method == "OPTIONS":
-        return {"system": "preflight"}, None, None
     user = get_current_user()
     if not user:
-        return None, jsonify({'success': False, 'error': 'unauthorized', 'message': 'Authentication required'}), 401
+        return None, Response(_UNAUTH_BODY, mimetype='application/json'), 401
     return user, None, None
 
+def release(conn, cursor=None):
+    """ปิด cursor แล้วคืน connection ให้ pool เสมอ
+    (ห้ามเช็ค conn.is_connected() ก่อน: connection ที่หลุดจะไม่ถูกคืนและ pool จะรั่วจนหมด)"""
+    if cursor is not None:
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def read_route(dict_cursor=True):
+    """auth + ยืม connection + try/except/finally ของ route อ่านอย่างเดียว รวมไว้ที่เดียว
+    handler รับ user, conn, cursor (dict_cursor=None → ไม่สร้าง cursor ให้) แล้วคืน response ได้เลย"""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            user, error_response, status_code = require_auth()
+            if error_response: return error_response, status_code
+
+            conn = get_db_connection()
+            if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+
+            cursor = None
+            try:
+                if dict_cursor is not None:
+                    cursor = conn.cursor(dictionary=dict_cursor)
+                return fn(*args, user=user, conn=conn, cursor=cursor, **kwargs)
+            except Error as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+            finally:
+                release(conn, cursor)
+        return wrapper
+    return deco
+
+# ownership check ใช้ทุก route ที่เขียนข้อมูล → SQL คงที่ ส่งผ่าน prepared statement ที่ค้างไว้ต่อ connection
+_SQL_FIELD_OWNER = "SELECT user_id FROM field WHERE field_id = %s"
+_SQL_ZONE_OWNER = (
+    "SELECT f.user_id FROM zone z JOIN field f ON z.field_id = f.field_id "
+    "WHERE z.zone_id = %s"
+)
+
+# สิทธิ์ของ route เขียนข้อมูลตรวจใน SQL เสมอ (WHERE ... user_id หรือ _SQL_*_OWNED) ไม่เชื่อ cache
+_SQL_FIELD_OWNED = "SELECT 1 FROM field WHERE field_id = %s AND user_id = %s"
+_SQL_ZONE_OWNED = (
+    "SELECT 1 FROM zone z JOIN field f ON z.field_id = f.field_id "
+    "WHERE z.zone_id = %s AND f.user_id = %s"
+)
+
+# เจ้าของแปลง/โซนไม่เปลี่ยน (ไม่มี route ไหนย้าย field_id/user_id) → จำต่อ worker ได้ ข้าม 1 round-trip
+# ใช้แค่แยก 403/404 หลัง SQL ปฏิเสธแล้ว: worker อื่นอาจยังจำแปลง/โซนที่ถูกลบไปแล้วได้ไม่เกิน TTL
+_OWNER_CACHE_TTL = 300
+_field_owner_cache = TTLCache(maxsize=50_000, ttl=_OWNER_CACHE_TTL)
+_zone_owner_cache = TTLCache(maxsize=50_000, ttl=_OWNER_CACHE_TTL)
+_owner_lock = threading.Lock()
+
+def _cached_owner(cache, conn, sql, key):
+    with _owner_lock:
+        owner = cache.get(key)
+    if owner is not None:
+        return owner
+    rows = run_prepared(conn, sql, (key,))
+    owner = rows[0][0] if rows else None
+    if owner is not None:
+        with _owner_lock:
+            cache[key] = owner
+    return owner
+
+def field_owner(conn, field_id):
+    """user_id เจ้าของแปลง หรือ None ถ้าไม่มีแปลงนี้"""
+    return _cached_owner(_field_owner_cache, conn, _SQL_FIELD_OWNER, field_id)
+
+def zone_owner(conn, zone_id):
+    """user_id เจ้าของโซน (ผ่าน field) หรือ None ถ้าไม่มีโซนนี้"""
+    return _cached_owner(_zone_owner_cache, conn, _SQL_ZONE_OWNER, zone_id)
+
+def field_denied(conn, field_id, user_id):
+    """response เมื่อ SQL ไม่ยอมเขียนแปลงนี้ให้ user: เจ้าของเป็นคนอื่น → 403, นอกนั้น → 404"""
+    owner = field_owner(conn, field_id)
+    if owner is not None and owner != user_id:
+        return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}), 403
+    forget_owner(field_id=field_id)  # cache บอกว่าเป็นของเรา แต่ SQL หาไม่เจอ → ถูกลบไปแล้ว
+    return jsonify({'success': False, 'error': 'Field not found'}), 404
+
+def zone_denied(conn, zone_id, user_id):
+    """response เมื่อ SQL ไม่ยอมเขียนโซนนี้ให้ user: เจ้าของเป็นคนอื่น → 403, นอกนั้น → 404"""
+    owner = zone_owner(conn, zone_id)
+    if owner is not None and owner != user_id:
+        return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
+    forget_owner(zone_id=zone_id)
+    return jsonify({'success': False, 'error': 'Zone not found'}), 404
+
+def forget_owner(field_id=None, zone_id=None):
+    with _owner_lock:
+        if field_id is not None:
+            _field_owner_cache.pop(field_id, None)
+        if zone_id is not None:
+            _zone_owner_cache.pop(zone_id, None)
+
+_FIELD_POINT_COLS = ('field_id', 'latitude', 'longitude', 'point_order')
+_MARK_ZONE_COLS = ('zone_id', 'tree_no', 'latitude', 'longitude')
+
 def num_or_none(value):
+    # float() รับ int/float/Decimal/str (มีช่องว่างหน้าหลังได้) และปัดเศษถูกต้องเหมือนผ่าน Decimal
+    # จึงไม่ต้องสร้าง Decimal ทุกค่า; ค่าว่าง/แปลงไม่ได้ → None
     if value is None:
         return None
-    if isinstance(value, (int, float)):
-        return float(value)
-    s = str(value).strip()
-    if s == '':
-        return None
+    if type(value) is float:  # JSON number จาก orjson เป็น float อยู่แล้ว (กรณีส่วนใหญ่)
+        return value
     try:
-        return float(Decimal(s))
-    except (InvalidOperation, ValueError):
+        return float(value)
+    except (TypeError, ValueError):
         return None
 
 def ensure_json():
     if request.is_json:
-        return request.get_json(silent=True) or {}
+        # body อ่านครั้งเดียวที่นี่ → ไม่ต้องเก็บ cache ใน request; parse ด้วย orjson ตรง ๆ
+        try:
+            data = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            return {}
+        return data if isinstance(data, dict) else {}
     data = request.form.to_dict(flat=True)
     for k in request.form:
         vals = request.form.getlist(k)
@@ -55,66 +172,85 @@ def ensure_json():
 def coerce_list_vertices(vertices):
     if vertices is None:
         return []
-    if isinstance(vertices, str):
+    if isinstance(vertices, (str, bytes)):
         try:
-            vertices = json.loads(vertices)
-        except json.JSONDecodeError:
+            vertices = orjson.loads(vertices)
+        except orjson.JSONDecodeError:
             return []
     if not isinstance(vertices, list):
         return []
-    out = []
-    order = 1
-    for v in vertices:
-        if not isinstance(v, dict):
-            continue
-        lat = num_or_none(v.get('latitude') if 'latitude' in v else v.get('lat'))
-        lng = num_or_none(v.get('longitude') if 'longitude' in v else v.get('lng'))
-        if lat is None or lng is None:
-            continue
-        out.append({'latitude': lat, 'longitude': lng, 'point_order': order})
-        order += 1
-    return out
+    # คืน [(lat, lng), ...] เรียงตามที่ส่งมา; point_order คือลำดับใน list (1..N) ใส่ตอน INSERT
+    pts = [
+        (num_or_none(v['latitude'] if 'latitude' in v else v.get('lat')),
+         num_or_none(v['longitude'] if 'longitude' in v else v.get('lng')))
+        for v in vertices if isinstance(v, dict)
+    ]
+    return [p for p in pts if p[0] is not None and p[1] is not None]
+
+def coerce_marks(marks):
+    """[(tree_no, lat, lng), ...] จาก marks ที่ client ส่งมา; ข้ามรายการที่ไม่ใช่ dict/พิกัดไม่ครบ
+    tree_no ไม่ส่งมา → ใช้ลำดับใน list (1..N)"""
+    if not isinstance(marks, list):
+        return []
+    pts = [
+        (m.get('tree_no', i), num_or_none(m.get('latitude')), num_or_none(m.get('longitude')))
+        for i, m in enumerate(marks, start=1) if isinstance(m, dict)
+    ]
+    return [(int(tn), lat, lng) for tn, lat, lng in pts if lat is not None and lng is not None]
+
+_EARTH_RADIUS_M = 6378137.0
+
+def polygon_area_m2(vertices):
+    """พื้นที่ polygon บนทรงกลม (ตร.ม.) จาก [(lat, lng), ...] ของ coerce_list_vertices; น้อยกว่า 3 จุด → None
+    (สูตรเดียวกับ Google Maps/Turf computeArea; MariaDB ST_Area ไม่รองรับพิกัด geographic)"""
+    if len(vertices) < 3:
+        return None
+    pts = [(math.radians(lat), math.radians(lng)) for lat, lng in vertices]
+    total = 0.0
+    lat1, lng1 = pts[-1]
+    for lat2, lng2 in pts:
+        total += (lng2 - lng1) * (2 + math.sin(lat1) + math.sin(lat2))
+        lat1, lng1 = lat2, lng2
+    return round(abs(total) * _EARTH_RADIUS_M * _EARTH_RADIUS_M / 2.0, 2)
+
+def field_size(data, vertices):
+    # มีรูปแปลงครบ → ใช้พื้นที่ที่คำนวณจาก vertices (กันเลขจาก client ไม่ตรงกับรูป); ไม่มีค่อยใช้ค่าที่ส่งมา
+    # polygon เสีย (พื้นที่ 0) ไม่ fallback ไปเลขของ client: คืน 0.0 ให้ route ตอบ 400
+    area = polygon_area_m2(vertices)
+    if area is None:
+        return num_or_none(data.get('size_square_meter'))
+    return area
 
 # ==================== FIELDS ROUTES ====================
 
-@field_zone_bp.route('/fields', methods=['GET'])
-def get_fields():
-    user, error_response, status_code = require_auth()
-    if error_response: return error_response, status_code
-
-    conn = get_db_connection()
-    if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
+# read ที่เรียกบ่อยที่สุด (หน้าแรก/หน้าแปลงของแอป) → SQL คงที่ ใช้ prepared statement ต่อ connection
+# นับ vertex ใน query เดียว (LEFT JOIN + GROUP BY) แทนการยิง IN(...) รอบที่สอง
+_SQL_GET_FIELDS = """
+    SELECT f.field_id, f.field_name, f.size_square_meter, f.created_at,
+           COUNT(fp.point_id) AS vertex_count
+    FROM field f
+    LEFT JOIN field_point fp ON fp.field_id = f.field_id
+    WHERE f.user_id = %s
+    GROUP BY f.field_id
+    ORDER BY f.field_name
+"""
+_SQL_FIELD_DETAIL = """
+    SELECT field_id, field_name, size_square_meter, created_at
+    FROM field
+    WHERE field_id = %s AND user_id = %s
+"""
+_SQL_FIELD_VERTICES = """
+    SELECT point_id, point_order, latitude, longitude
+    FROM field_point
+    WHERE field_id = %s
+    ORDER BY point_order ASC
+"""
 
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT field_id, field_name, size_square_meter, created_at
-            FROM field
-            WHERE user_id = %s
-            ORDER BY field_name
-        """, (user['user_id'],))
-        fields = cursor.fetchall()
-
-        if fields:
-            field_ids = [f['field_id'] for f in fields]
-            format_strings = ','.join(['%s'] * len(field_ids))
-            cursor.execute(f"""
-                SELECT field_id, COUNT(*) AS vertex_count
-                FROM field_point
-                WHERE field_id IN ({format_strings})
-                GROUP BY field_id
-            """, field_ids)
-            vc_map = {row['field_id']: row['vertex_count'] for row in cursor.fetchall()}
-            for f in fields:
-                f['vertex_count'] = vc_map.get(f['field_id'], 0)
-
-        return jsonify({'success': True, 'data': fields})
-    except Error as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+@field_zone_bp.route('/fields', methods=['GET'])
+@read_route(dict_cursor=None)
+def get_fields(user, conn, cursor):
+    fields = run_prepared(conn, _SQL_GET_FIELDS, (user['user_id'],), dict=True)
+    return {'success': True, 'data': fields}
 
 @field_zone_bp.route('/fields', methods=['POST'])
 def create_field():
@@ -124,8 +260,8 @@ def create_field():
     try:
         data = ensure_json()
         field_name = (data.get('field_name') or '').strip()
-        size_square_meter = num_or_none(data.get('size_square_meter'))
         vertices = coerce_list_vertices(data.get('vertices'))
+        size_square_meter = field_size(data, vertices)
 
         if not field_name or size_square_meter is None or size_square_meter <= 0:
             return jsonify({'success': False, 'error': 'กรุณากรอกข้อมูลให้ครบถ้วน'}), 400
@@ -133,6 +269,7 @@ def create_field():
         conn = get_db_connection()
         if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+        cursor = None
         try:
             cursor = conn.cursor()
             cursor.execute("""
@@ -142,11 +279,8 @@ def create_field():
             field_id = cursor.lastrowid
 
             if vertices:
-                vals = [(field_id, v['latitude'], v['longitude'], v['point_order']) for v in vertices]
-                cursor.executemany("""
-                    INSERT INTO field_point (field_id, latitude, longitude, point_order)
-                    VALUES (%s, %s, %s, %s)
-                """, vals)
+                vals = [(field_id, lat, lng, order) for order, (lat, lng) in enumerate(vertices, start=1)]
+                bulk_insert(cursor, 'field_point', _FIELD_POINT_COLS, vals)
 
             conn.commit()
             return jsonify({'success': True, 'field_id': field_id, 'message': 'สร้างแปลงสำเร็จ'})
@@ -154,47 +288,24 @@ def create_field():
             conn.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
         finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+            release(conn, cursor)
     except Exception as e:
         current_app.logger.exception("create_field failed")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @field_zone_bp.route('/fields/<int:field_id>', methods=['GET'])
-def get_field_details(field_id):
-    user, error_response, status_code = require_auth()
-    if error_response: return error_response, status_code
-
-    conn = get_db_connection()
-    if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
-
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT field_id, field_name, size_square_meter, created_at
-            FROM field
-            WHERE field_id = %s AND user_id = %s
-        """, (field_id, user['user_id']))
-        field_row = cursor.fetchone()
-        if not field_row:
-            return jsonify({'success': False, 'error': 'Field not found'}), 404
-
-        cursor.execute("""
-            SELECT point_id, point_order, latitude, longitude
-            FROM field_point
-            WHERE field_id = %s
-            ORDER BY point_order ASC
-        """, (field_id,))
-        field_row['vertices'] = cursor.fetchall()
-
-        return jsonify({'success': True, 'data': field_row})
-    except Error as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+@read_route(dict_cursor=None)
+def get_field_details(field_id, user, conn, cursor):
+    rows = run_prepared(conn, _SQL_FIELD_DETAIL, (field_id, user['user_id']), dict=True)
+    if not rows:
+        return {'success': False, 'error': 'Field not found'}, 404
+    field_row = rows[0]
+    # tuple ตรงจาก prepared cursor → สร้าง dict ต่อจุดครั้งเดียว ไม่ผ่าน zip กับ column_names ทุกแถว
+    field_row['vertices'] = [
+        {'point_id': pid, 'point_order': order, 'latitude': lat, 'longitude': lng}
+        for pid, order, lat, lng in run_prepared(conn, _SQL_FIELD_VERTICES, (field_id,))
+    ]
+    return {'success': True, 'data': field_row}
 
 @field_zone_bp.route('/fields/<int:field_id>', methods=['PUT'])
 def update_field(field_id):
@@ -205,8 +316,8 @@ def update_field(field_id):
         current_app.logger.debug("PUT /fields/%s RAW=%s", field_id, request.get_data(as_text=True))
         data = ensure_json()
         field_name = (data.get('field_name') or '').strip()
-        size_square_meter = num_or_none(data.get('size_square_meter'))
         vertices = coerce_list_vertices(data.get('vertices', None))
+        size_square_meter = field_size(data, vertices)
 
         if not field_name or size_square_meter is None or size_square_meter <= 0:
             return jsonify({'success': False, 'error': 'กรุณากรอกข้อมูลให้ครบถ้วน'}), 400
@@ -214,30 +325,25 @@ def update_field(field_id):
         conn = get_db_connection()
         if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+        cursor = None
         try:
             cursor = conn.cursor()
 
-            cursor.execute("SELECT user_id FROM field WHERE field_id = %s", (field_id,))
-            row = cursor.fetchone()
-            if not row:
-                return jsonify({'success': False, 'error': 'Field not found'}), 404
-            if row[0] != user['user_id']:
-                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}), 403
-
             cursor.execute("""
                 UPDATE field
                 SET field_name = %s, size_square_meter = %s
-                WHERE field_id = %s
-            """, (field_name, size_square_meter, field_id))
+                WHERE field_id = %s AND user_id = %s
+            """, (field_name, size_square_meter, field_id, user['user_id']))
+            # rowcount นับเฉพาะแถวที่ค่าเปลี่ยน → 0 อาจแปลว่าค่าเดิมอยู่แล้ว ต้องเช็คต่อใน DB (ไม่ใช้ cache)
+            # แถวที่ match ถูก UPDATE ล็อกไว้แล้วแม้ค่าไม่เปลี่ยน → ไม่มีใครลบแทรกได้จนกว่าจะ commit
+            if cursor.rowcount == 0 and not run_prepared(conn, _SQL_FIELD_OWNED, (field_id, user['user_id'])):
+                return field_denied(conn, field_id, user['user_id'])
 
             if 'vertices' in data:
                 cursor.execute("DELETE FROM field_point WHERE field_id = %s", (field_id,))
                 if vertices:
-                    vals = [(field_id, v['latitude'], v['longitude'], v['point_order']) for v in vertices]
-                    cursor.executemany("""
-                        INSERT INTO field_point (field_id, latitude, longitude, point_order)
-                        VALUES (%s, %s, %s, %s)
-                    """, vals)
+                    vals = [(field_id, lat, lng, order) for order, (lat, lng) in enumerate(vertices, start=1)]
+                    bulk_insert(cursor, 'field_point', _FIELD_POINT_COLS, vals)
 
             conn.commit()
             return jsonify({'success': True, 'message': 'อัปเดตแปลงสำเร็จ'})
@@ -246,9 +352,7 @@ def update_field(field_id):
             current_app.logger.exception("update_field mysql error")
             return jsonify({'success': False, 'error': str(e)}), 500
         finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+            release(conn, cursor)
     except Exception as e:
         current_app.logger.exception("update_field failed (unexpected)")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -261,107 +365,93 @@ def delete_field(field_id):
     conn = get_db_connection()
     if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+    cursor = None
     try:
         cursor = conn.cursor()
-        cursor.execute("SELECT user_id FROM field WHERE field_id = %s", (field_id,))
-        owner = cursor.fetchone()
-        if not owner:
+        # สิทธิ์ + เงื่อนไข "ไม่มีโซน" อยู่ใน DELETE เดียว: 1 round-trip และไม่มีช่องให้โซนใหม่แทรกระหว่างเช็คกับลบ
+        cursor.execute("""
+            DELETE FROM field
+            WHERE field_id = %s AND user_id = %s
+              AND NOT EXISTS (SELECT 1 FROM zone WHERE zone.field_id = field.field_id)
+        """, (field_id, user['user_id']))
+        if cursor.rowcount == 0:
+            # ไม่ได้ลบ → ค่อยแยกว่าเพราะอะไร
+            owner = field_owner(conn, field_id)
+            if owner is not None and owner != user['user_id']:
+                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}), 403
+            if owner is not None:
+                cursor.execute("SELECT EXISTS(SELECT 1 FROM zone WHERE field_id = %s)", (field_id,))
+                if cursor.fetchone()[0]:
+                    return jsonify({'success': False, 'error': 'ไม่สามารถลบแปลงที่มีโซนอยู่ได้ กรุณาลบโซนก่อน'}), 400
+            forget_owner(field_id=field_id)
             return jsonify({'success': False, 'error': 'Field not found'}), 404
-        if owner[0] != user['user_id']:
-            return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}), 403
 
-        cursor.execute("SELECT COUNT(*) FROM zone WHERE field_id = %s", (field_id,))
-        zone_count = cursor.fetchone()[0]
-        if zone_count > 0:
-            return jsonify({'success': False, 'error': 'ไม่สามารถลบแปลงที่มีโซนอยู่ได้ กรุณาลบโซนก่อน'}), 400
-
-        cursor.execute("DELETE FROM field WHERE field_id = %s", (field_id,))
         conn.commit()
+        forget_owner(field_id=field_id)
         return jsonify({'success': True, 'message': 'ลบแปลงสำเร็จ'})
     except Error as e:
         conn.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
     finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+        release(conn, cursor)
 
 @field_zone_bp.route('/fields/<int:field_id>/zones', methods=['GET'])
-def get_zones_by_field(field_id):
-    user, error_response, status_code = require_auth()
-    if error_response: return error_response, status_code
+@read_route()
+def get_zones_by_field(field_id, user, conn, cursor):
+    # สิทธิ์อยู่ใน WHERE เลย; ผลว่างค่อยเช็คว่าแปลงไม่มีโซนจริงหรือไม่มีสิทธิ์
+    cursor.execute("""
+        SELECT z.zone_id, z.zone_name, z.num_trees,
+               COUNT(zi.inspection_id) AS inspection_count
+        FROM zone z
+        JOIN field f ON f.field_id = z.field_id
+        LEFT JOIN zone_inspection zi ON zi.zone_id = z.zone_id
+        WHERE z.field_id = %s AND f.user_id = %s
+        GROUP BY z.zone_id
+        ORDER BY z.zone_name
+    """, (field_id, user['user_id']))
+    zones = cursor.fetchall()
+    if not zones and field_owner(conn, field_id) != user['user_id']:
+        return {'success': False, 'error': 'Access denied'}, 403
+    return {'success': True, 'data': zones}
 
-    conn = get_db_connection()
-    if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
-
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT user_id FROM field WHERE field_id = %s", (field_id,))
-        field_row = cursor.fetchone()
-        if not field_row or field_row['user_id'] != user['user_id']:
-            return jsonify({'success': False, 'error': 'Access denied'}), 403
+# ==================== ZONES ROUTES ====================
 
+@field_zone_bp.route('/zones', methods=['GET'])
+@read_route()
+def list_zones(user, conn, cursor):
+    field_id = request.args.get('field_id', type=int)
+    if field_id:
         cursor.execute("""
-            SELECT z.zone_id, z.zone_name, z.num_trees,
-                   (SELECT COUNT(*) FROM zone_inspection zi WHERE zi.zone_id = z.zone_id) AS inspection_count
+            SELECT z.zone_id, z.zone_name, z.num_trees, z.field_id,
+                   COUNT(zi.inspection_id) AS inspection_count
             FROM zone z
-            WHERE z.field_id = %s
+            JOIN field f ON f.field_id = z.field_id
+            LEFT JOIN zone_inspection zi ON zi.zone_id = z.zone_id
+            WHERE z.field_id = %s AND f.user_id = %s
+            GROUP BY z.zone_id
             ORDER BY z.zone_name
-        """, (field_id,))
+        """, (field_id, user['user_id']))
         zones = cursor.fetchall()
-        return jsonify({'success': True, 'data': zones})
-    except Error as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
-
-# ==================== ZONES ROUTES ====================
-
-@field_zone_bp.route('/zones', methods=['GET'])
-def list_zones():
-    user, error_response, status_code = require_auth()
-    if error_response: return error_response, status_code
-
-    field_id = request.args.get('field_id', type=int)
-    conn = get_db_connection()
-    if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
-
-    try:
-        cur = conn.cursor(dictionary=True)
-        if field_id:
-            cur.execute("SELECT user_id FROM field WHERE field_id=%s", (field_id,))
-            owner = cur.fetchone()
-            if not owner:
-                return jsonify({'success': False, 'error': 'Field not found'}), 404
-            if owner['user_id'] != user['user_id']:
-                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}), 403
-
-            cur.execute("""
-                SELECT z.zone_id, z.zone_name, z.num_trees, z.field_id,
-                       (SELECT COUNT(*) FROM zone_inspection zi WHERE zi.zone_id = z.zone_id) AS inspection_count
-                FROM zone z
-                WHERE z.field_id = %s
-                ORDER BY z.zone_name
-            """, (field_id,))
-        else:
-            cur.execute("""
-                SELECT z.zone_id, z.zone_name, z.num_trees, z.field_id,
-                       (SELECT COUNT(*) FROM zone_inspection zi WHERE zi.zone_id = z.zone_id) AS inspection_count
-                FROM zone z
-                JOIN field f ON z.field_id = f.field_id
-                WHERE f.user_id = %s
-                ORDER BY z.field_id, z.zone_name
-            """, (user['user_id'],))
-        zones = cur.fetchall()
-        return jsonify({'success': True, 'data': zones})
-    except Error as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        if conn.is_connected():
-            cur.close()
-            conn.close()
+        if not zones:
+            owner = field_owner(conn, field_id)
+            if owner is None:
+                return {'success': False, 'error': 'Field not found'}, 404
+            if owner != user['user_id']:
+                return {'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}, 403
+        return {'success': True, 'data': zones}
+
+    cursor.execute("""
+        SELECT z.zone_id, z.zone_name, z.num_trees, z.field_id,
+               COUNT(zi.inspection_id) AS inspection_count
+        FROM zone z
+        JOIN field f ON z.field_id = f.field_id
+        LEFT JOIN zone_inspection zi ON zi.zone_id = z.zone_id
+        WHERE f.user_id = %s
+        GROUP BY z.zone_id
+        ORDER BY z.field_id, z.zone_name
+    """, (user['user_id'],))
+    zones = cursor.fetchall()
+    return {'success': True, 'data': zones}
 
 @field_zone_bp.route('/zones', methods=['POST'])
 def create_zone():
@@ -378,51 +468,34 @@ def create_zone():
         if not field_id or not zone_name:
             return jsonify({'success': False, 'error': 'กรุณากรอกข้อมูลให้ครบถ้วน'}), 400
 
+        # แปลง marks ก่อนเปิด connection → รู้จำนวนต้นที่จะ INSERT จริง ใส่ num_trees ตอนสร้างโซนได้เลย
+        # (ไม่ต้อง COUNT + UPDATE ตามหลังอีก 2 round-trip)
+        mark_rows = coerce_marks(marks)
         if isinstance(marks, list) and marks:
-            num_trees = len(marks)
+            num_trees = len(mark_rows)
         if num_trees is None:
             num_trees = 0
 
         conn = get_db_connection()
         if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+        cursor = None
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT user_id FROM field WHERE field_id = %s", (field_id,))
-            owner = cursor.fetchone()
-            if not owner:
-                return jsonify({'success': False, 'error': 'Field not found'}), 404
-            if owner[0] != user['user_id']:
-                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงแปลงนี้'}), 403
-
+            # INSERT ... SELECT กรองสิทธิ์ในตัว → ไม่มีแถวเข้า = ไม่มีแปลง/ไม่ใช่เจ้าของ ค่อยเช็คแยก
             cursor.execute("""
                 INSERT INTO zone (zone_name, num_trees, field_id)
-                VALUES (%s, %s, %s)
-            """, (zone_name, int(num_trees), int(field_id)))
+                SELECT %s, %s, field_id FROM field
+                WHERE field_id = %s AND user_id = %s
+            """, (zone_name, int(num_trees), int(field_id), user['user_id']))
+            if cursor.rowcount == 0:
+                return field_denied(conn, field_id, user['user_id'])
             zone_id = cursor.lastrowid
 
             inserted = 0
-            if isinstance(marks, list) and marks:
-                vals = []
-                for i, m in enumerate(marks, start=1):
-                    if not isinstance(m, dict):
-                        continue
-                    tn = m.get('tree_no', i)
-                    lat = num_or_none(m.get('latitude'))
-                    lng = num_or_none(m.get('longitude'))
-                    if lat is None or lng is None:
-                        continue
-                    vals.append((zone_id, int(tn), lat, lng))
-                if vals:
-                    cursor.executemany("""
-                        INSERT INTO mark_zone (zone_id, tree_no, latitude, longitude)
-                        VALUES (%s, %s, %s, %s)
-                    """, vals)
-                    inserted = len(vals)
-
-                cursor.execute("SELECT COUNT(*) FROM mark_zone WHERE zone_id = %s", (zone_id,))
-                count = cursor.fetchone()[0]
-                cursor.execute("UPDATE zone SET num_trees = %s WHERE zone_id = %s", (count, zone_id))
+            if mark_rows:
+                bulk_insert(cursor, 'mark_zone', _MARK_ZONE_COLS, [(zone_id, tn, lat, lng) for tn, lat, lng in mark_rows])
+                inserted = len(mark_rows)
 
             conn.commit()
             return jsonify({'success': True, 'zone_id': zone_id, 'inserted_marks': inserted, 'message': 'สร้างโซนสำเร็จ'})
@@ -430,40 +503,27 @@ def create_zone():
             conn.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
         finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+            release(conn, cursor)
     except Exception as e:
         current_app.logger.exception("create_zone failed")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @field_zone_bp.route('/zones/<int:zone_id>', methods=['GET'])
-def get_zone_details(zone_id):
-    user, error_response, status_code = require_auth()
-    if error_response: return error_response, status_code
-
-    conn = get_db_connection()
-    if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
-
-    try:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT z.zone_id, z.zone_name, z.num_trees, z.field_id,
-                   (SELECT COUNT(*) FROM zone_inspection zi WHERE zi.zone_id = z.zone_id) AS inspection_count
-            FROM zone z
-            JOIN field f ON z.field_id = f.field_id
-            WHERE z.zone_id = %s AND f.user_id = %s
-        """, (zone_id, user['user_id']))
-        zone_row = cursor.fetchone()
-        if not zone_row:
-            return jsonify({'success': False, 'error': 'Zone not found'}), 404
-        return jsonify({'success': True, 'data': zone_row})
-    except Error as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
-    finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+@read_route()
+def get_zone_details(zone_id, user, conn, cursor):
+    cursor.execute("""
+        SELECT z.zone_id, z.zone_name, z.num_trees, z.field_id,
+               COUNT(zi.inspection_id) AS inspection_count
+        FROM zone z
+        JOIN field f ON z.field_id = f.field_id
+        LEFT JOIN zone_inspection zi ON zi.zone_id = z.zone_id
+        WHERE z.zone_id = %s AND f.user_id = %s
+        GROUP BY z.zone_id
+    """, (zone_id, user['user_id']))
+    zone_row = cursor.fetchone()
+    if not zone_row:
+        return {'success': False, 'error': 'Zone not found'}, 404
+    return {'success': True, 'data': zone_row}
 
 @field_zone_bp.route('/zones/<int:zone_id>', methods=['PUT'])
 def update_zone(zone_id):
@@ -481,33 +541,25 @@ def update_zone(zone_id):
         conn = get_db_connection()
         if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+        cursor = None
         try:
             cursor = conn.cursor()
             cursor.execute("""
-                SELECT f.user_id FROM zone z
+                UPDATE zone z
                 JOIN field f ON z.field_id = f.field_id
-                WHERE z.zone_id = %s
-            """, (zone_id,))
-            result = cursor.fetchone()
-            if not result:
-                return jsonify({'success': False, 'error': 'Zone not found'}), 404
-            if result[0] != user['user_id']:
-                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
-
-            cursor.execute("""
-                UPDATE zone
-                SET zone_name = %s, num_trees = %s
-                WHERE zone_id = %s
-            """, (zone_name, int(num_trees), zone_id))
+                SET z.zone_name = %s, z.num_trees = %s
+                WHERE z.zone_id = %s AND f.user_id = %s
+            """, (zone_name, int(num_trees), zone_id, user['user_id']))
+            # rowcount นับเฉพาะแถวที่ค่าเปลี่ยน → 0 อาจแปลว่าค่าเดิมอยู่แล้ว ต้องเช็คต่อใน DB (ไม่ใช้ cache)
+            if cursor.rowcount == 0 and not run_prepared(conn, _SQL_ZONE_OWNED, (zone_id, user['user_id'])):
+                return zone_denied(conn, zone_id, user['user_id'])
             conn.commit()
             return jsonify({'success': True, 'message': 'อัปเดตโซนสำเร็จ'})
         except Error as e:
             conn.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
         finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+            release(conn, cursor)
     except Exception as e:
         current_app.logger.exception("update_zone failed")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -520,34 +572,34 @@ def delete_zone(zone_id):
     conn = get_db_connection()
     if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+    cursor = None
     try:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT f.user_id FROM zone z
-            JOIN field f ON z.field_id = f.field_id
-            WHERE z.zone_id = %s
-        """, (zone_id,))
-        result = cursor.fetchone()
-        if not result:
+            DELETE z FROM zone z
+            JOIN field f ON f.field_id = z.field_id
+            WHERE z.zone_id = %s AND f.user_id = %s
+              AND NOT EXISTS (SELECT 1 FROM zone_inspection zi WHERE zi.zone_id = z.zone_id)
+        """, (zone_id, user['user_id']))
+        if cursor.rowcount == 0:
+            owner = zone_owner(conn, zone_id)
+            if owner is not None and owner != user['user_id']:
+                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
+            if owner is not None:
+                cursor.execute("SELECT EXISTS(SELECT 1 FROM zone_inspection WHERE zone_id = %s)", (zone_id,))
+                if cursor.fetchone()[0]:
+                    return jsonify({'success': False, 'error': 'ไม่สามารถลบโซนที่มีประวัติการตรวจแล้ว'}), 400
+            forget_owner(zone_id=zone_id)
             return jsonify({'success': False, 'error': 'Zone not found'}), 404
-        if result[0] != user['user_id']:
-            return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
-
-        cursor.execute("SELECT COUNT(*) FROM zone_inspection WHERE zone_id = %s", (zone_id,))
-        insp_count = cursor.fetchone()[0]
-        if insp_count > 0:
-            return jsonify({'success': False, 'error': 'ไม่สามารถลบโซนที่มีประวัติการตรวจแล้ว'}), 400
 
-        cursor.execute("DELETE FROM zone WHERE zone_id = %s", (zone_id,))
         conn.commit()
+        forget_owner(zone_id=zone_id)
         return jsonify({'success': True, 'message': 'ลบโซนสำเร็จ'})
     except Error as e:
         conn.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
     finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+        release(conn, cursor)
 
 # ==================== MARK ZONE ROUTES ====================
 
@@ -559,31 +611,60 @@ def get_marks(zone_id):
     conn = get_db_connection()
     if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+    cursor = None
+    streaming = False
     try:
-        cursor = conn.cursor(dictionary=True)
+        # unbuffered: ไม่ดึงทุกแถวมาเป็น list ก่อน → ทยอยอ่าน fetchmany แล้วส่งออกเป็นก้อน ๆ
+        cursor = conn.cursor()
+        # สิทธิ์อยู่ใน WHERE เลย → 1 round-trip; ผลว่างค่อยเช็คว่าโซนว่างจริงหรือไม่มีสิทธิ์
         cursor.execute("""
-            SELECT f.user_id FROM zone z
-            JOIN field f ON z.field_id = f.field_id
-            WHERE z.zone_id = %s
-        """, (zone_id,))
-        owner = cursor.fetchone()
-        if not owner or owner['user_id'] != user['user_id']:
-            return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
+            SELECT m.latitude, m.longitude, m.mark_id, m.tree_no
+            FROM mark_zone m
+            JOIN zone z ON z.zone_id = m.zone_id
+            JOIN field f ON f.field_id = z.field_id
+            WHERE m.zone_id = %s AND f.user_id = %s
+            ORDER BY m.tree_no ASC, m.mark_id ASC
+        """, (zone_id, user['user_id']))
+        first = cursor.fetchmany(_MARKS_CHUNK)
+        if not first:
+            if zone_owner(conn, zone_id) != user['user_id']:
+                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
+            return jsonify({'success': True, 'data': [], 'count': 0})
 
-        cursor.execute("""
-            SELECT mark_id, tree_no, latitude, longitude
-            FROM mark_zone
-            WHERE zone_id = %s
-            ORDER BY tree_no ASC, mark_id ASC
-        """, (zone_id,))
-        marks = cursor.fetchall()
-        return jsonify({'success': True, 'data': marks, 'count': len(marks)})
+        resp = Response(_stream_marks(cursor, first), mimetype='application/json')
+        # WSGI server เรียก close() เสมอ (รวมกรณี client ตัดกลางทาง / generator ยังไม่เริ่ม) → คืน connection ตรงนั้น
+        resp.call_on_close(lambda: _release_stream(conn, cursor))
+        streaming = True
+        return resp
     except Error as e:
         return jsonify({'success': False, 'error': str(e)}), 500
     finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+        if not streaming:
+            release(conn, cursor)
+
+_MARKS_CHUNK = 500
+
+def _stream_marks(cursor, rows):
+    """{"data":[...],"count":N,"success":true} ทีละ _MARKS_CHUNK แถว"""
+    count = 0
+    yield b'{"data":['
+    while rows:
+        body = b','.join(
+            orjson.dumps({'latitude': lat, 'longitude': lng, 'mark_id': mid, 'tree_no': tn})
+            for lat, lng, mid, tn in rows
+        )
+        yield (b',' + body) if count else body
+        count += len(rows)
+        rows = cursor.fetchmany(_MARKS_CHUNK)
+    yield b'],"count":%d,"success":true}' % count
+
+def _release_stream(conn, cursor):
+    # ส่งไม่จบ → ยังมีแถวค้างบน connection; อ่านทิ้งก่อนคืน pool ไม่งั้นคนถัดไปเจอ "Unread result found"
+    try:
+        conn.consume_results()
+    except Exception:
+        pass
+    release(conn, cursor)
 
 @field_zone_bp.route('/zones/<int:zone_id>/marks', methods=['POST'])
 def create_mark(zone_id):
@@ -603,47 +684,39 @@ def create_mark(zone_id):
         conn = get_db_connection()
         if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+        cursor = None
         try:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT f.user_id FROM zone z
-                JOIN field f ON z.field_id = f.field_id
-                WHERE z.zone_id = %s
-            """, (zone_id,))
-            owner = cursor.fetchone()
-            if not owner:
-                return jsonify({'success': False, 'error': 'Zone not found'}), 404
-            if owner[0] != user['user_id']:
-                return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
-
             inserted = 0
             if isinstance(marks, list) and marks:
-                vals = []
-                for i, m in enumerate(marks, start=1):
-                    if not isinstance(m, dict):
-                        continue
-                    tn = m.get('tree_no', i)
-                    lat = num_or_none(m.get('latitude'))
-                    lng = num_or_none(m.get('longitude'))
-                    if lat is None or lng is None:
-                        continue
-                    vals.append((zone_id, int(tn), lat, lng))
+                # สิทธิ์ตรวจใน DB + shared lock กันโซนถูกลบระหว่างนี้จน commit
+                if not run_prepared(conn, _SQL_ZONE_OWNED + " LOCK IN SHARE MODE", (zone_id, user['user_id'])):
+                    return zone_denied(conn, zone_id, user['user_id'])
+                vals = [(zone_id, tn, lat, lng) for tn, lat, lng in coerce_marks(marks)]
                 if vals:
-                    cursor.executemany("""
-                        INSERT INTO mark_zone (zone_id, tree_no, latitude, longitude)
-                        VALUES (%s, %s, %s, %s)
-                    """, vals)
+                    bulk_insert(cursor, 'mark_zone', _MARK_ZONE_COLS, vals)
                     inserted = len(vals)
             else:
+                # mark เดียว: INSERT ... SELECT กรองสิทธิ์ในตัว → ไม่มีแถวเข้าค่อยแยก 404/403
                 cursor.execute("""
                     INSERT INTO mark_zone (zone_id, tree_no, latitude, longitude)
-                    VALUES (%s, %s, %s, %s)
-                """, (zone_id, int(tree_no), latitude, longitude))
+                    SELECT z.zone_id, %s, %s, %s
+                    FROM zone z
+                    JOIN field f ON f.field_id = z.field_id
+                    WHERE z.zone_id = %s AND f.user_id = %s
+                """, (int(tree_no), latitude, longitude, zone_id, user['user_id']))
+                if cursor.rowcount == 0:
+                    return zone_denied(conn, zone_id, user['user_id'])
                 inserted = 1
 
-            cursor.execute("SELECT COUNT(*) FROM mark_zone WHERE zone_id = %s", (zone_id,))
-            count = cursor.fetchone()[0]
-            cursor.execute("UPDATE zone SET num_trees = %s WHERE zone_id = %s", (count, zone_id))
+            # นับใหม่ + เขียน num_trees ใน UPDATE เดียว; LAST_INSERT_ID(expr) ส่งค่าที่นับได้กลับมาทาง OK packet
+            # (cursor.lastrowid) จึงไม่ต้อง SELECT COUNT แยกอีกรอบ
+            cursor.execute("""
+                UPDATE zone
+                SET num_trees = LAST_INSERT_ID((SELECT COUNT(*) FROM mark_zone WHERE zone_id = %s))
+                WHERE zone_id = %s
+            """, (zone_id, zone_id))
+            count = cursor.lastrowid or 0
 
             conn.commit()
             return jsonify({'success': True, 'inserted': inserted, 'num_trees': count, 'message': 'เพิ่ม mark สำเร็จ'})
@@ -651,9 +724,7 @@ def create_mark(zone_id):
             conn.rollback()
             return jsonify({'success': False, 'error': str(e)}), 500
         finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
+            release(conn, cursor)
     except Exception as e:
         current_app.logger.exception("create_mark failed")
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -672,51 +743,55 @@ def replace_marks(zone_id):
     conn = get_db_connection()
     if not conn: return jsonify({'success': False, 'error': 'Database connection failed'}), 500
 
+    cursor = None
     try:
         cursor = conn.cursor()
+        # ตรวจสิทธิ์ใน DB + ล็อกแถวโซนก่อนอ่านของเดิม: PUT พร้อมกันบนโซนเดียวกันต้องรอกัน
+        # (READ COMMITTED ไม่กันสองคนเห็น snapshot เดียวกันแล้ว INSERT แถวเดียวกันซ้ำ)
+        cursor.execute(_SQL_ZONE_OWNED + " FOR UPDATE", (zone_id, user['user_id']))
+        if cursor.fetchone() is None:
+            return zone_denied(conn, zone_id, user['user_id'])
+
+        rows = coerce_marks(marks)
+
+        # diff กับของเดิมแทน DELETE ทั้งโซน + INSERT ใหม่หมด: แถวที่เหมือนเดิมไม่ถูกแตะเลย
+        # (tree_no ซ้ำกันได้ จึงจับคู่ด้วยค่าทั้งแถว ไม่ใช้ UNIQUE(zone_id, tree_no))
         cursor.execute("""
-            SELECT f.user_id FROM zone z
-            JOIN field f ON z.field_id = f.field_id
-            WHERE z.zone_id = %s
+            SELECT mark_id, tree_no, latitude, longitude FROM mark_zone
+            WHERE zone_id = %s ORDER BY mark_id
         """, (zone_id,))
-        owner = cursor.fetchone()
-        if not owner:
-            return jsonify({'success': False, 'error': 'Zone not found'}), 404
-        if owner[0] != user['user_id']:
-            return jsonify({'success': False, 'error': 'ไม่มีสิทธิ์เข้าถึงโซนนี้'}), 403
-
-        # ลบทิ้งทั้งหมดก่อน
-        cursor.execute("DELETE FROM mark_zone WHERE zone_id = %s", (zone_id,))
-
-        inserted = 0
-        if marks:
-            vals = []
-            for i, m in enumerate(marks, start=1):
-                if not isinstance(m, dict):
-                    continue
-                tn = int(m.get('tree_no', i))
-                lat = num_or_none(m.get('latitude'))
-                lng = num_or_none(m.get('longitude'))
-                if lat is None or lng is None:
-                    continue
-                vals.append((zone_id, tn, lat, lng))
-            if vals:
-                cursor.executemany("""
-                    INSERT INTO mark_zone (zone_id, tree_no, latitude, longitude)
-                    VALUES (%s, %s, %s, %s)
-                """, vals)
-                inserted = len(vals)
-
-        cursor.execute("SELECT COUNT(*) FROM mark_zone WHERE zone_id = %s", (zone_id,))
-        count = cursor.fetchone()[0]
+        unchanged = {}
+        for mark_id, tn, lat, lng in cursor.fetchall():
+            unchanged.setdefault((tn, lat, lng), []).append(mark_id)
+
+        pending = []
+        for r in rows:
+            ids = unchanged.get(r)
+            if ids:
+                ids.pop(0)
+            else:
+                pending.append(r)
+        spare = [mid for ids in unchanged.values() for mid in ids]
+
+        # แถวที่เปลี่ยน: DELETE ชุดเดียว + bulk INSERT ชุดเดียว (จำนวน statement คงที่ ไม่ขึ้นกับจำนวน mark)
+        if spare:
+            cursor.execute(
+                "DELETE FROM mark_zone WHERE mark_id IN (%s)" % ', '.join(['%s'] * len(spare)),
+                tuple(spare),
+            )
+        written = bulk_insert(cursor, 'mark_zone', _MARK_ZONE_COLS, [(zone_id, tn, lat, lng) for tn, lat, lng in pending])
+
+        # inserted = จำนวน marks ในโซนหลังแทนที่ (ความหมายเดิมของ API)
+        # written = จำนวนแถวที่ต้องเขียนจริง (แถวที่ค่าเหมือนเดิมไม่นับ)
+        inserted = len(rows)
+        count = inserted
         cursor.execute("UPDATE zone SET num_trees = %s WHERE zone_id = %s", (count, zone_id))
 
         conn.commit()
-        return jsonify({'success': True, 'inserted': inserted, 'num_trees': count, 'message': 'แทนที่พิกัดสำเร็จ'})
+        return jsonify({'success': True, 'inserted': inserted, 'written': written, 'num_trees': count,
+                        'message': 'แทนที่พิกัดสำเร็จ'})
     except Error as e:
         conn.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
     finally:
-        if conn.is_connected():
-            cursor.close()
-            conn.close()
+        release(conn, cursor)
@@ -1,10 +1,12 @@
 # routes/inspection.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, g
 from config.database import get_db_connection
+from config.tokens import bearer_payload
 from mysql.connector import Error
 from datetime import datetime, date, timedelta
 from pathlib import Path
-import jwt, os, json
+import os, json
+import orjson
 
 from routes.detect import predict_on_paths  # ใช้โมเดลจาก detect.py
 
@@ -13,29 +15,28 @@ inspection_bp = Blueprint('inspection', __name__)
 STATUS_OPEN = 'pending'
 STATUS_DONE = 'completed'
 
-ALLOWED_EXTS = {'jpg', 'jpeg', 'png', 'bmp', 'webp'}
+ALLOWED_EXTS = frozenset({'jpg', 'jpeg', 'png', 'bmp', 'webp'})
 MAX_FILE_BYTES = 20 * 1024 * 1024
 MAX_IMAGES_PER_ROUND = 5
 
 # ---------- helpers (auth / io) ----------
 def _get_user():
-    auth = request.headers.get('Authorization', '')
-    if not auth.startswith('Bearer '):
-        return None
-    token = auth.split(' ')[1]
-    try:
-        return jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-    except jwt.InvalidTokenError:
-        return None
+    if '_jwt_user' not in g:
+        g._jwt_user = bearer_payload(request.headers.get('Authorization'), current_app.config['JWT_SECRET_KEY'])
+    return g._jwt_user
 
 def _user_id(u):
     if not isinstance(u, dict):
         return None
     return u.get('user_id') or u.get('sub') or u.get('uid')
 
-def _authz():
+@inspection_bp.before_request
+def _skip_preflight():
+    # CORS preflight ตอบตรงนี้ (header มาจาก flask-cors) ไม่ต้องเข้า handler
     if request.method == 'OPTIONS':
-        return None, ('', 204)
+        return current_app.make_default_options_response()
+
+def _authz():
     u = _get_user()
     if not u:
         return None, (jsonify({'success': False,'error': 'unauthorized','message': 'Authentication required'}), 401)
@@ -43,7 +44,12 @@ def _authz():
 
 def _ensure_json():
     if request.is_json:
-        return request.get_json(silent=True) or {}
+        # อ่าน body ครั้งเดียว ไม่ cache ใน request; parse ด้วย orjson เหมือน field_zone.ensure_json
+        try:
+            data = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            return {}
+        return data if isinstance(data, dict) else {}
     return {}
 
 def _parse_yyyy_mm_dd(s):
@@ -72,7 +78,8 @@ def _ensure_dir(p: Path):
     p.mkdir(parents=True, exist_ok=True)
 
 def _ext_ok(filename: str) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[-1].lower() in ALLOWED_EXTS
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTS
 
 # ---------- NORMALIZE / WHITELIST สำหรับผลโมเดล ----------
 # เจอ "nomal" หรือ "normal" หรือ "healthy" ให้ถือว่า "ปกติ" → ไม่ INSERT finding
@@ -610,7 +617,7 @@ def get_recommendations(inspection_id):
 # ---------- recommendations: patch ----------
 @inspection_bp.route('/recommendations/<int:rec_id>', methods=['PATCH', 'PUT', 'OPTIONS'])
 def patch_recommendation(rec_id):
-    user, err = _authz().__iter__() if False else _authz()
+    user, err = _authz()
     if err: return err
     uid = _user_id(user)
     if uid is None:
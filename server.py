@@ -1,16 +1,20 @@
 # server.py
 from flask import Flask, jsonify, request, current_app
+from flask.logging import default_handler
 from flask_cors import CORS, cross_origin
-import os, logging, jwt
-from datetime import datetime, timedelta, timezone
+import os, time, logging, jwt, atexit, queue
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
 from functools import wraps
 from pathlib import Path
 
 # ===== Base routes =====
 from routes.auth import auth_bp
 from routes.field_zone import field_zone_bp
+from config.json_provider import OrjsonProvider
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)  # jsonify ทุก route ใช้ orjson
 
 # ==================== CONFIG ====================
 app.config['JWT_SECRET_KEY'] = os.environ.get("JWT_SECRET_KEY", "dev-secret-key")
@@ -29,10 +33,23 @@ UPLOAD_FOLDER = UPLOAD_FOLDER.resolve(strict=False)
 UPLOAD_FOLDER.mkdir(parents=True, exist_ok=True)
 os.environ['UPLOAD_ROOT'] = str(UPLOAD_FOLDER)
 
-# Logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Logging: QueueHandler ยัง format ข้อความบน thread ของ request (prepare() เรียก self.format)
+# สิ่งที่ย้ายไป thread ของ QueueListener คือการเขียน stderr (I/O ที่อาจ block) เท่านั้น
+# ระดับ log ตั้งจาก env LOG_LEVEL (ค่าเริ่มต้น INFO) → log ที่ต่ำกว่าระดับนี้ถูกตัดทิ้งก่อน format
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_stream, respect_handler_level=True)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+_root_logger = logging.getLogger()
+_root_logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+_root_logger.handlers[:] = [QueueHandler(_log_queue)]
+# app.logger ส่งต่อขึ้น root → ไม่ต้องมี default_handler ของ Flask (เขียน stderr ตรง ๆ)
+app.logger.removeHandler(default_handler)
 logger = logging.getLogger(__name__)
-logger.info(f"[BOOT] UPLOAD_ROOT = {UPLOAD_FOLDER}")
+logger.info("[BOOT] UPLOAD_ROOT = %s", UPLOAD_FOLDER)
 
 # CORS
 CORS(
@@ -41,7 +58,9 @@ CORS(
     supports_credentials=False,
     allow_headers=["Authorization", "Content-Type", "X-Requested-With", "Accept"],
     expose_headers=["Authorization"],
-    methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"]
+    methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"],
+    # ให้เบราว์เซอร์ cache ผล preflight (Chrome รับสูงสุด 2 ชม.) → ไม่ต้องยิง OPTIONS ก่อนทุก request
+    max_age=int(os.environ.get("CORS_MAX_AGE", "7200")),
 )
 
 # ==================== OPTIONAL BLUEPRINTS ====================
@@ -54,14 +73,14 @@ try:
     inspection_bp = _inspection_bp
     logger.info("✅ Loaded routes.inspection successfully")
 except Exception as e:
-    logger.error(f"❌ Failed to load routes.inspection: {e}")
+    logger.error("❌ Failed to load routes.inspection: %s", e)
 
 try:
     from routes.detect import bp_detect as _bp_detect
     bp_detect = _bp_detect
     logger.info("✅ Loaded routes.detect successfully")
 except Exception as e:
-    logger.warning(f"⚠️ routes.detect not loaded: {e}")
+    logger.warning("⚠️ routes.detect not loaded: %s", e)
 
 try:
     # NOTE: routes/reference.py ควรกำหนด url_prefix="/api/reference" ภายในไฟล์นั้นแล้ว
@@ -69,20 +88,22 @@ try:
     reference_bp = _reference_bp
     logger.info("✅ Loaded routes.reference successfully")
 except Exception as e:
-    logger.warning(f"⚠️ routes.reference not loaded: {e}")
+    logger.warning("⚠️ routes.reference not loaded: %s", e)
 
 # ==================== JWT HELPERS ====================
+_JWT_EXP_SECONDS = JWT_EXPIRY_DAYS * 86400
+
 def generate_token(user_data):
-    now = datetime.now(timezone.utc)
+    now = int(time.time())  # NumericDate เป็น int อยู่แล้ว ไม่ต้องสร้าง datetime/timedelta
     payload = {
         'user_id': user_data['user_id'],
         'username': user_data['username'],
         'name': user_data.get('name', ''),
-        'exp': now + timedelta(days=JWT_EXPIRY_DAYS),
+        'exp': now + _JWT_EXP_SECONDS,
         'iat': now
     }
     token = jwt.encode(payload, app.config['JWT_SECRET_KEY'], algorithm='HS256')
-    logger.info(f"Token generated for user: {user_data['username']}")
+    logger.info("Token generated for user: %s", user_data['username'])
     return token
 
 def verify_token(token):
@@ -91,7 +112,7 @@ def verify_token(token):
     except jwt.ExpiredSignatureError:
         logger.warning("Token expired"); return None
     except jwt.InvalidTokenError as e:
-        logger.warning(f"Invalid token: {e}"); return None
+        logger.warning("Invalid token: %s", e); return None
 
 def get_token_from_header():
     auth_header = request.headers.get('Authorization')
@@ -119,7 +140,7 @@ def require_auth(f):
 def before_request():
     if request.endpoint in ['static', 'health_check', 'index', 'list_routes']:
         return
-    logger.debug(f"=== REQUEST {request.method} {request.url} ===")
+    logger.debug("=== REQUEST %s %s ===", request.method, request.url)
 
 @app.after_request
 def after_request(response):
@@ -305,14 +326,18 @@ def not_found(error): return jsonify({'success': False, 'error': 'not_found', 'm
 def internal_error(error): return jsonify({'success': False, 'error': 'server_error', 'message': 'Internal server error'}), 500
 
 # ==================== MAIN ====================
+# Production: รันผ่าน gunicorn แบบ thread worker เช่น
+#   gunicorn -k gthread --workers 2 --threads $(nproc) server:app
+# argon2-cffi (hash ใหม่) และ bcrypt (ตรวจ hash เก่า) ปล่อย GIL ระหว่างคำนวณ →
+# login/register หลาย request ใน process เดียวใช้หลาย core ได้จริง (จำนวนพร้อมกันคุมด้วย PW_HASH_WORKERS)
 if __name__ == '__main__':
     logger.info("Starting Flask server with JWT-only authentication...")
-    logger.info(f"JWT token expiry: {JWT_EXPIRY_DAYS} days")
-    logger.info(f"UPLOAD_ROOT={UPLOAD_FOLDER}")
+    logger.info("JWT token expiry: %s days", JWT_EXPIRY_DAYS)
+    logger.info("UPLOAD_ROOT=%s", UPLOAD_FOLDER)
 
     logger.info("Blueprint status:")
-    logger.info(f"  - inspection_bp: {'✅ LOADED (/api/inspections)' if inspection_bp is not None else '❌ FAILED'}")
-    logger.info(f"  - bp_detect: {'✅ LOADED (/api/detect)' if bp_detect is not None else '⚠️ NOT LOADED'}")
-    logger.info(f"  - reference_bp: {'✅ LOADED (/api/reference)' if reference_bp is not None else '⚠️ NOT LOADED'}")
+    logger.info("  - inspection_bp: %s", '✅ LOADED (/api/inspections)' if inspection_bp is not None else '❌ FAILED')
+    logger.info("  - bp_detect: %s", '✅ LOADED (/api/detect)' if bp_detect is not None else '⚠️ NOT LOADED')
+    logger.info("  - reference_bp: %s", '✅ LOADED (/api/reference)' if reference_bp is not None else '⚠️ NOT LOADED')
 
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', '5000')), debug=True, threaded=True, use_reloader=False)
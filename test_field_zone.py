@@ -0,0 +1,39 @@
+# test_field_zone.py
+# unit test ของ helper คำนวณพื้นที่แปลง (ไม่ต้องมี DB/server): python -m pytest -q test_field_zone.py
+import math
+
+from routes.field_zone import polygon_area_m2, field_size
+
+# 100 เมตรตามแนวเมริเดียนเป็นองศา (รัศมีเดียวกับที่ polygon_area_m2 ใช้)
+_D100 = 100 / (math.pi * 6378137.0 / 180)
+
+def _square_100m(lat0, lng0):
+    dlng = _D100 / math.cos(math.radians(lat0))
+    return [(lat0, lng0), (lat0, lng0 + dlng), (lat0 + _D100, lng0 + dlng), (lat0 + _D100, lng0)]
+
+def test_square_100m_at_equator():
+    assert math.isclose(polygon_area_m2(_square_100m(0.0, 0.0)), 10000.0, abs_tol=1.0)
+
+def test_square_100m_in_thailand():
+    assert math.isclose(polygon_area_m2(_square_100m(13.0, 100.0)), 10000.0, abs_tol=1.0)
+
+def test_winding_order_does_not_matter():
+    sq = _square_100m(13.0, 100.0)
+    assert polygon_area_m2(sq) == polygon_area_m2(sq[::-1])
+
+def test_less_than_three_vertices_is_none():
+    assert polygon_area_m2([]) is None
+    assert polygon_area_m2([(13.0, 100.0), (13.001, 100.0)]) is None
+
+def test_degenerate_polygon_is_zero():
+    assert polygon_area_m2([(13.0, 100.0)] * 3) == 0.0
+
+def test_field_size_prefers_polygon_over_client_value():
+    assert math.isclose(field_size({'size_square_meter': 1}, _square_100m(13.0, 100.0)), 10000.0, abs_tol=1.0)
+
+def test_field_size_degenerate_polygon_does_not_fall_back():
+    # route ตอบ 400 เมื่อพื้นที่ <= 0
+    assert field_size({'size_square_meter': 500}, [(13.0, 100.0)] * 3) == 0.0
+
+def test_field_size_without_polygon_uses_client_value():
+    assert field_size({'size_square_meter': '1500.5'}, []) == 1500.5